@@ -1,33 +1,89 @@
 import datetime
-from email.mime.multipart import MIMEMultipart
-import smtplib
-from email.mime.text import MIMEText
-from typing import Dict, Optional
+from typing import Dict, List, Optional, Tuple
 import os
 
+from sqlalchemy import Date, Integer, Text, and_, bindparam, case, cast, column, extract, func, literal, not_, or_, select, \
+    true, update, values
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from models import AdminModifiedPresence, DailyPresence, User, HoursDefault
+from models import AdminModifiedPresence, DailyPresence, User, HoursDefault, EmployeeMonthSummary
 from serialization import DailyPresenceBase, HoursDefaultBase, UserBase
 from datetime import datetime
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Font, PatternFill, Alignment, Side, Border
 from openpyxl.drawing.image import Image
 from openpyxl.worksheet.page import PageMargins
 from io import BytesIO
-from datetime import time
+from copy import copy
+from datetime import time, date
 
 
 def get_user_by_username(db: Session, work_email: str):
     return db.query(User).filter(User.work_email == work_email).first()
 
 
+async def get_user_by_username_async(db: AsyncSession, work_email: str):
+    return await db.scalar(select(User).where(User.work_email == work_email).limit(1))
+
+
+def month_range(year, month) -> Tuple[date, date]:
+    # Half-open [first day, first day of next month) so the (employee_id, date) indexes can be used
+    month_start = date(int(year), int(month), 1)
+    if month_start.month == 12:
+        return month_start, date(month_start.year + 1, 1, 1)
+    return month_start, date(month_start.year, month_start.month + 1, 1)
+
+
+def get_month_presences(db: Session, model, user_id: int, year, month):
+    month_start, month_end = month_range(year, month)
+    return (db.query(model)
+            .filter(model.employee_id == user_id,
+                    model.date >= month_start,
+                    model.date < month_end)
+            .order_by(model.date)
+            .all())
+
+
+def get_company_month_presences(db: Session, model, employee_ids: List[int], year, month) -> Dict[int, list]:
+    # The month of every given employee in one query, instead of one query per employee
+    month_start, month_end = month_range(year, month)
+    presences = {employee_id: [] for employee_id in employee_ids}
+    rows = (db.query(model)
+            .filter(model.employee_id.in_(employee_ids),
+                    model.date >= month_start,
+                    model.date < month_end)
+            .order_by(model.employee_id, model.date)
+            .all())
+    for row in rows:
+        presences[row.employee_id].append(row)
+    return presences
+
+
+def stream_month_payroll(db: Session, year, month, batch_size: int):
+    """Every AdminModifiedPresence row of the month with the name and IBAN of its employee, by
+    employee and date, in batches of batch_size rows fetched from a server-side cursor."""
+    month_start, month_end = month_range(year, month)
+    query = (select(AdminModifiedPresence.employee_id, User.name, User.surname, User.iban, AdminModifiedPresence.date,
+                    AdminModifiedPresence.modified_entry_time_morning, AdminModifiedPresence.modified_exit_time_morning,
+                    AdminModifiedPresence.modified_entry_time_afternoon,
+                    AdminModifiedPresence.modified_exit_time_afternoon, AdminModifiedPresence.modified_extra_hours,
+                    AdminModifiedPresence.modified_time_off, AdminModifiedPresence.modified_day_off,
+                    AdminModifiedPresence.modified_national_holiday, AdminModifiedPresence.modified_weekend,
+                    AdminModifiedPresence.modified_illness, AdminModifiedPresence.modified_notes)
+             .join(User, User.id == AdminModifiedPresence.employee_id)
+             .where(AdminModifiedPresence.date >= month_start, AdminModifiedPresence.date < month_end)
+             .order_by(AdminModifiedPresence.employee_id, AdminModifiedPresence.date)
+             .execution_options(yield_per=batch_size))
+    return db.execute(query).partitions()
+
+
 # Get Daily Presences for a specific user and month
 def get_daily_presences(db: Session, user_id: int, year: int, month: int):
-    return db.query(DailyPresence).filter(
-        DailyPresence.user_id == user_id,
-        DailyPresence.date.year == year,
-        DailyPresence.date.month == month).all()
+    return get_month_presences(db, DailyPresence, user_id, year, month)
 
 
 # Create or update a daily presence record
@@ -51,6 +107,127 @@ def create_or_update_daily_presence(db: Session, user_id: int, daily_presence_da
     return presence_record
 
 
+# Columns shared by DailyPresence and AdminModifiedPresence (the latter prefixed with "modified_")
+PRESENCE_FIELDS = ("entry_time_morning", "exit_time_morning", "entry_time_afternoon", "exit_time_afternoon",
+                   "national_holiday", "weekend", "day_off", "time_off", "extra_hours", "illness", "notes")
+
+
+def upsert_statement(db: Session, model):
+    # INSERT ... ON CONFLICT is dialect specific; sqlite is used for local runs and benchmarks
+    if db.get_bind().dialect.name == "sqlite":
+        return sqlite.insert(model)
+    return postgresql.insert(model)
+
+
+def normalize_month_days(presence_data: List[DailyPresenceBase]) -> Dict[date, DailyPresenceBase]:
+    days = {}
+    for day_data in presence_data:
+        if day_data.day_off or day_data.national_holiday or day_data.weekend:
+            day_data.entry_time_morning = time(0, 0)
+            day_data.exit_time_morning = time(0, 0)
+            day_data.entry_time_afternoon = time(0, 0)
+            day_data.exit_time_afternoon = time(0, 0)
+        # A day may only be touched once per set-based statement, the last entry wins
+        days[day_data.date] = day_data
+    return days
+
+
+def modified_to_daily_presence(record) -> DailyPresenceBase:
+    return DailyPresenceBase(
+        employee_id=record.employee_id,
+        date=record.date,
+        entry_time_morning=record.modified_entry_time_morning,
+        exit_time_morning=record.modified_exit_time_morning,
+        entry_time_afternoon=record.modified_entry_time_afternoon,
+        exit_time_afternoon=record.modified_exit_time_afternoon,
+        national_holiday=record.modified_national_holiday,
+        weekend=record.modified_weekend,
+        day_off=record.modified_day_off,
+        time_off=record.modified_time_off,
+        extra_hours=record.modified_extra_hours,
+        illness=record.modified_illness,
+        notes=record.modified_notes
+    )
+
+
+def bulk_upsert_monthly_presence(db: Session, user_id: int, presence_data: List[DailyPresenceBase]) -> List[DailyPresenceBase]:
+    days = normalize_month_days(presence_data)
+
+    daily_rows = [dict(employee_id=user_id, date=day.date, **{field: getattr(day, field) for field in PRESENCE_FIELDS})
+                  for day in days.values()]
+    daily_stmt = upsert_statement(db, DailyPresence).values(daily_rows)
+    daily_stmt = daily_stmt.on_conflict_do_update(
+        index_elements=["employee_id", "date"],
+        set_={field: daily_stmt.excluded[field] for field in PRESENCE_FIELDS})
+    daily_records = db.scalars(daily_stmt.returning(DailyPresence),
+                               execution_options={"populate_existing": True}).all()
+
+    # A new employee submission always resets the admin copy of the same days
+    admin_rows = [dict(employee_id=user_id, original_presence_id=record.id, date=record.date,
+                       **{f"modified_{field}": getattr(record, field) for field in PRESENCE_FIELDS})
+                  for record in daily_records]
+    admin_stmt = upsert_statement(db, AdminModifiedPresence).values(admin_rows)
+    admin_stmt = admin_stmt.on_conflict_do_update(
+        index_elements=["employee_id", "date"],
+        set_={column: admin_stmt.excluded[column] for column in admin_rows[0] if column not in ("employee_id", "date")})
+    db.execute(admin_stmt)
+
+    for year, month in {(day.year, day.month) for day in days}:
+        refresh_month_summary(db, user_id, year, month)
+
+    # Serialize before commit so that expired records are not reloaded one by one
+    response_data = sorted((DailyPresenceBase.from_orm(record) for record in daily_records), key=lambda day: day.date)
+    db.commit()
+    return response_data
+
+
+# Extra hours are kept as submitted by the employee, admins override the rest
+ADMIN_OVERRIDE_FIELDS = tuple(field for field in PRESENCE_FIELDS if field != "extra_hours")
+
+
+def bulk_update_admin_presence(db: Session, user_id: int, presence_data: List[DailyPresenceBase]) -> Optional[List[DailyPresenceBase]]:
+    days = normalize_month_days(presence_data)
+    table = AdminModifiedPresence.__table__
+
+    # Validate up front so a missing day never leaves the month half overridden
+    existing_days = db.query(AdminModifiedPresence.date).filter(
+        AdminModifiedPresence.employee_id == user_id,
+        AdminModifiedPresence.date.in_(list(days))
+    ).count()
+    if existing_days != len(days):
+        return None
+
+    if db.get_bind().dialect.name == "sqlite":
+        # sqlite cannot name the columns of a VALUES alias, fall back to a single executemany
+        stmt = update(table).where(
+            table.c.employee_id == user_id,
+            table.c.date == bindparam("override_date")
+        ).values({f"modified_{field}": bindparam(f"override_{field}") for field in ADMIN_OVERRIDE_FIELDS})
+        db.execute(stmt, [dict(override_date=day.date,
+                               **{f"override_{field}": getattr(day, field) for field in ADMIN_OVERRIDE_FIELDS})
+                          for day in days.values()])
+        records = db.execute(table.select().where(table.c.employee_id == user_id,
+                                                  table.c.date.in_(list(days)))).all()
+    else:
+        overrides = values(
+            column("date", Date),
+            *[column(field, table.c[f"modified_{field}"].type) for field in ADMIN_OVERRIDE_FIELDS],
+            name="overrides"
+        ).data([(day.date, *[getattr(day, field) for field in ADMIN_OVERRIDE_FIELDS]) for day in days.values()])
+        stmt = (update(table)
+                .where(table.c.employee_id == user_id, table.c.date == overrides.c.date)
+                .values({f"modified_{field}": cast(overrides.c[field], table.c[f"modified_{field}"].type)
+                         for field in ADMIN_OVERRIDE_FIELDS})
+                .returning(*table.c))
+        records = db.execute(stmt).all()
+
+    for year, month in {(day.year, day.month) for day in days}:
+        refresh_month_summary(db, user_id, year, month)
+
+    db.commit()
+    return sorted((modified_to_daily_presence(record) for record in records), key=lambda day: day.date)
+
+
 def create_default_hours(db: Session, defaults: HoursDefaultBase):
     default_hours = db.query(HoursDefault).filter(HoursDefault.user_id == defaults.user_id,
                                                   HoursDefault.submitted_by_id == defaults.submitted_by_id).first()
@@ -84,6 +261,14 @@ def get_user_by_id(db: Session, user_id: int):
     return employee
 
 
+async def get_user_by_id_async(db: AsyncSession, user_id: int):
+    return await db.scalar(select(User).where(User.id == user_id).limit(1))
+
+
+async def get_token_version_async(db: AsyncSession, user_id: int):
+    return await db.scalar(select(User.token_version).where(User.id == user_id))
+
+
 def get_hour_minute(timeFormat: int) -> (int, int):
     hoursPart = int(timeFormat) // 1
     minutesPart = (int(timeFormat) % 1) * 60
@@ -91,40 +276,38 @@ def get_hour_minute(timeFormat: int) -> (int, int):
 
 
 def has_submitted_presence(employee_id: int, year: str, month: str, db: Session) -> bool:
-    presence = db.query(DailyPresence).filter_by(
-        employee_id=employee_id,
-        date=datetime.strptime(year+month, "%Y%m")
+    month_start, month_end = month_range(year, month)
+    presence = db.query(DailyPresence.id).filter(
+        DailyPresence.employee_id == employee_id,
+        DailyPresence.date >= month_start,
+        DailyPresence.date < month_end
     ).first()
     return bool(presence)
 
 
 def has_admin_submitted_presence(employee_id: int, year: str, month: str, db: Session) -> bool:
-    presence = db.query(AdminModifiedPresence).filter_by(
-        employee_id=employee_id,
-        date=datetime.strptime(year+month, "%Y%m")
+    month_start, month_end = month_range(year, month)
+    presence = db.query(AdminModifiedPresence.id).filter(
+        AdminModifiedPresence.employee_id == employee_id,
+        AdminModifiedPresence.date >= month_start,
+        AdminModifiedPresence.date < month_end
     ).first()
     return bool(presence)
 
 
-def send_email_to_employee(receiver_email: str, subject: str, body: str):
-    smtp_server = "smtps.aruba.it"
-    smtp_port = 465
-    smtp_user_sender = os.getenv("SMTP_USERNAME")
-    smtp_sender_password = os.getenv("SMTP_PASSWORD")
+def get_month_submission_status(db: Session, year: str, month: str, model=DailyPresence) -> Tuple[List[User], List[User]]:
+    # One EXISTS per employee evaluated inside a single query, instead of one query per employee
+    month_start, month_end = month_range(year, month)
+    has_presence = select(model.id).where(
+        model.employee_id == User.id,
+        model.date >= month_start,
+        model.date < month_end
+    ).exists()
+    rows = db.query(User, has_presence).filter(User.role == 'employee').order_by(User.id).all()
 
-    try:
-        with smtplib.SMTP_SSL(smtp_server, smtp_port) as server:
-            msg = MIMEMultipart("alternative")
-            html_part = MIMEText(body, "html")
-            msg.attach(html_part)
-            server.login(smtp_user_sender, smtp_sender_password)
-            msg.attach(html_part)
-            msg["Subject"] = subject
-            msg["From"] = smtp_user_sender
-            msg["To"] = receiver_email
-            server.sendmail(smtp_user_sender, receiver_email, msg.as_string())
-    except Exception as e:
-        print(f"Failed to send email to {receiver_email}: {e}")
+    submitted_employees = [employee for employee, submitted in rows if submitted]
+    missing_employees = [employee for employee, submitted in rows if not submitted]
+    return submitted_employees, missing_employees
 
 
 def calculate_hours_per_day(morning_in, morning_out, afternoon_in, afternoon_out):
@@ -141,7 +324,345 @@ def calculate_hours_per_day(morning_in, morning_out, afternoon_in, afternoon_out
     return total_hours
 
 
-def create_excel_original(presence_data: [DailyPresence], employeeOverview: Dict=Optional):
+SUMMARY_FIELDS = ("worked_hours", "extra_hours", "off_hours", "off_days", "expected_hours",
+                  "extra_hours_days", "off_hours_days", "days_off_days", "notes")
+
+
+def hours_of(t: time) -> float:
+    return (t.hour * 3600 + t.minute * 60 + t.second) / 3600
+
+
+def summarize_month(presence_data, prefix: str = "") -> Dict:
+    # prefix is "modified_" when summarizing AdminModifiedPresence rows
+    summary = {"worked_hours": 0, "extra_hours": 0, "off_hours": 0, "off_days": 0, "expected_hours": 0,
+               "extra_hours_days": "", "off_hours_days": "", "days_off_days": "", "notes": ""}
+
+    for day in presence_data:
+        def field(name):
+            return getattr(day, prefix + name)
+
+        if not (field("national_holiday") or field("weekend")):
+            summary["expected_hours"] += 8
+            if not field("day_off"):
+                summary["worked_hours"] += calculate_hours_per_day(field("entry_time_morning"),
+                                                                   field("exit_time_morning"),
+                                                                   field("entry_time_afternoon"),
+                                                                   field("exit_time_afternoon"))
+            else:
+                summary["off_days"] += 1
+                summary["days_off_days"] += f'{day.date.day}\n'
+        if field("notes"):
+            summary["notes"] += f'day={day.date.day} : {field("notes")}\n'
+
+        if field("extra_hours") and field("extra_hours") != time(0, 0):
+            summary["extra_hours"] += hours_of(field("extra_hours"))
+            summary["extra_hours_days"] += f'{day.date.day}\n'
+        if field("time_off") and field("time_off") != time(0, 0):
+            summary["off_hours"] += hours_of(field("time_off"))
+            summary["off_hours_days"] += f'{day.date.day}\n'
+
+    return summary
+
+
+def month_summary_select(model, prefix: str, user_id: int, month_start: date, month_end: date):
+    """Postgres aggregate equivalent of summarize_month() over one month of one table."""
+    table = model.__table__
+
+    def field(name):
+        return table.c[prefix + name]
+
+    def seconds_between(start, end):
+        # time - time is an interval on Postgres
+        return case((and_(start.isnot(None), end.isnot(None), end > start), extract("epoch", end - start)), else_=0)
+
+    def day_list(text, condition):
+        return func.coalesce(
+            func.string_agg(text, aggregate_order_by(literal(""), table.c.date)).filter(condition), "")
+
+    working_day = not_(or_(func.coalesce(field("national_holiday"), False), func.coalesce(field("weekend"), False)))
+    day_off = func.coalesce(field("day_off"), False)
+    has_extra_hours = and_(field("extra_hours").isnot(None), field("extra_hours") != time(0, 0))
+    has_time_off = and_(field("time_off").isnot(None), field("time_off") != time(0, 0))
+    has_notes = and_(field("notes").isnot(None), field("notes") != "")
+    day_number = cast(cast(extract("day", table.c.date), Integer), Text)
+    worked_seconds = (seconds_between(field("entry_time_morning"), field("exit_time_morning")) +
+                      seconds_between(field("entry_time_afternoon"), field("exit_time_afternoon")))
+
+    return select(
+        (func.coalesce(func.sum(worked_seconds).filter(and_(working_day, not_(day_off))), 0) / 3600)
+        .label(prefix + "worked_hours"),
+        (func.coalesce(func.sum(extract("epoch", field("extra_hours"))).filter(has_extra_hours), 0) / 3600)
+        .label(prefix + "extra_hours"),
+        (func.coalesce(func.sum(extract("epoch", field("time_off"))).filter(has_time_off), 0) / 3600)
+        .label(prefix + "off_hours"),
+        func.count().filter(and_(working_day, day_off)).label(prefix + "off_days"),
+        (func.count().filter(working_day) * 8).label(prefix + "expected_hours"),
+        day_list(day_number + "\n", has_extra_hours).label(prefix + "extra_hours_days"),
+        day_list(day_number + "\n", has_time_off).label(prefix + "off_hours_days"),
+        day_list(day_number + "\n", and_(working_day, day_off)).label(prefix + "days_off_days"),
+        day_list("day=" + day_number + " : " + field("notes") + "\n", has_notes).label(prefix + "notes"),
+    ).where(
+        table.c.employee_id == user_id,
+        table.c.date >= month_start,
+        table.c.date < month_end
+    )
+
+
+def refresh_month_summary(db: Session, user_id: int, year: int, month: int):
+    """Recompute the stored month figures of one employee and bump its revision. Runs in the caller's transaction."""
+    month_start, month_end = month_range(year, month)
+    columns = [prefix + name for prefix in ("", "modified_") for name in SUMMARY_FIELDS]
+
+    if db.get_bind().dialect.name == "postgresql":
+        # Both halves are aggregated by the database and written by the same statement
+        original = month_summary_select(DailyPresence, "", user_id, month_start, month_end).subquery()
+        modified = month_summary_select(AdminModifiedPresence, "modified_", user_id, month_start, month_end).subquery()
+        figures = select(literal(user_id), literal(year), literal(month), original, modified) \
+            .select_from(original.join(modified, true()))
+        stmt = upsert_statement(db, EmployeeMonthSummary).from_select(["employee_id", "year", "month", *columns], figures)
+    else:
+        rows = {}
+        for model, prefix in ((DailyPresence, ""), (AdminModifiedPresence, "modified_")):
+            table = model.__table__
+            presence_data = db.execute(table.select().where(
+                table.c.employee_id == user_id,
+                table.c.date >= month_start,
+                table.c.date < month_end
+            ).order_by(table.c.date)).all()
+            rows.update({prefix + key: value for key, value in summarize_month(presence_data, prefix).items()})
+        stmt = upsert_statement(db, EmployeeMonthSummary).values(employee_id=user_id, year=year, month=month, **rows)
+
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["employee_id", "year", "month"],
+        set_={**{column: stmt.excluded[column] for column in columns},
+              "revision": EmployeeMonthSummary.__table__.c.revision + 1})
+    db.execute(stmt)
+
+
+def get_month_revision(db: Session, user_id: int, year, month) -> Optional[int]:
+    """Version of the month's presences, None when it was never written through refresh_month_summary."""
+    month_start, _ = month_range(year, month)
+    return db.scalar(select(EmployeeMonthSummary.revision).where(
+        EmployeeMonthSummary.employee_id == user_id,
+        EmployeeMonthSummary.year == month_start.year,
+        EmployeeMonthSummary.month == month_start.month))
+
+
+def get_month_summary(db: Session, user_id: int, year, month) -> Optional[EmployeeMonthSummary]:
+    month_start, _ = month_range(year, month)
+    return db.query(EmployeeMonthSummary).filter(
+        EmployeeMonthSummary.employee_id == user_id,
+        EmployeeMonthSummary.year == month_start.year,
+        EmployeeMonthSummary.month == month_start.month
+    ).first()
+
+
+def format_month_overview(summary: Optional[EmployeeMonthSummary], prefix: str = "") -> Dict:
+    if summary:
+        figures = {name: getattr(summary, prefix + name) for name in SUMMARY_FIELDS}
+    else:
+        figures = summarize_month([])
+
+    totalWorkedHours, totalWorkedRemainedMinutes = get_hour_minute(figures["worked_hours"])
+    extraHoursHour, extraHoursMinute = get_hour_minute(figures["extra_hours"])
+    offHoursHour, offHoursMinute = get_hour_minute(figures["off_hours"])
+
+    return {'isSubmitted': summary is not None,
+            'notes': figures["notes"],
+            'totalWorkedHoursInMonth': f'{totalWorkedHours}:{totalWorkedRemainedMinutes}',
+            'totalExtraHoursInMonth': f'{extraHoursHour}:{extraHoursMinute} in days: {figures["extra_hours_days"]}',
+            'totalOffHoursInMonth': f'{offHoursHour}:{offHoursMinute} in days: {figures["off_hours_days"]} ',
+            'totalOffDaysInMonth': f' {figures["off_days"]} in days: {figures["days_off_days"]}',
+            'totalExpectedWorkingHours': figures["expected_hours"]}
+
+
+# Shared by every workbook of the write-only builders
+LOGO_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logo.png')
+with open(LOGO_PATH, 'rb') as logo_file:
+    LOGO = logo_file.read()
+
+HEADER_FONT = Font(bold=True)
+BOLD_FONT = Font(bold=True, size=12)
+CENTER_ALIGNMENT = Alignment(horizontal="center", vertical="center")
+THIN_BORDER = Border(left=Side(style='thin'), right=Side(style='thin'),
+                     top=Side(style='thin'), bottom=Side(style='thin'))
+HIGHLIGHT_FILL = PatternFill(start_color="0eff65", end_color="0eff65", fill_type="solid")
+WEEKEND_HOLIDAY_FILL = PatternFill(start_color="ffc7ab", end_color="ffc7ab", fill_type="solid")
+DAY_OFF_FILL = PatternFill(start_color="edec07", end_color="edec07", fill_type="solid")
+MODIFIED_WEEKEND_FILL = PatternFill(start_color="bcbcbc", end_color="bcbcbc", fill_type="solid")
+FESTIVITA_FILL = PatternFill(start_color="ffada7", end_color="ffada7", fill_type="solid")
+
+ORIGINAL_HEADER = ["Date", "Entrata", "Uscita", "Entrata", "Uscita",
+                   "FERIE", "FESTIVITÀ NAZIONALE", "WEEKEND", "STRAORDINARIO", "PERMESSO", "NOTE"]
+MODIFIED_HEADER = ["Date", "Entrata", "Uscita", "Entrata", "Uscita", "Ore", "Note"]
+MODIFIED_WIDTHS = {"A": 10, "B": 8, "C": 8, "D": 8, "E": 8, "F": 6, "G": 52}
+
+
+class CellStyles:
+    """Styled write-only cells of one workbook.
+
+    Assigning a font, fill, alignment or border hashes it into the workbook's style tables, so each
+    combination is registered once and its style indices copied to every cell that uses it.
+    """
+
+    def __init__(self, sheet):
+        self.sheet = sheet
+        self._styles = {}
+
+    def cell(self, value, font=None, fill=None, alignment=None, border=None) -> WriteOnlyCell:
+        cell = WriteOnlyCell(self.sheet)
+        key = (id(font), id(fill), id(alignment), id(border))
+        style = self._styles.get(key)
+        if style is None:
+            if font is not None:
+                cell.font = font
+            if fill is not None:
+                cell.fill = fill
+            if alignment is not None:
+                cell.alignment = alignment
+            if border is not None:
+                cell.border = border
+            style = self._styles[key] = cell._style
+        cell._style = copy(style)
+        # Set last, dates and times add their number format to the style
+        cell.value = value
+        return cell
+
+
+def save_workbook(workbook: Workbook) -> BytesIO:
+    excel_output = BytesIO()
+    workbook.save(excel_output)
+    excel_output.seek(0)
+    return excel_output
+
+
+def write_only_excel_original(presence_data: [DailyPresence], employeeOverview: Optional[Dict]) -> BytesIO:
+    workbook = Workbook(write_only=True)
+    sheet1 = workbook.create_sheet("Presenze mensile")
+    sheet1.column_dimensions["A"].width = 12
+    styles = CellStyles(sheet1)
+    sheet1.append([styles.cell(title, font=HEADER_FONT) for title in ORIGINAL_HEADER])
+
+    for day in presence_data:
+        row_fill = None
+        if day.day_off or day.national_holiday:
+            row_fill = DAY_OFF_FILL
+        elif day.weekend:
+            row_fill = WEEKEND_HOLIDAY_FILL
+        highlighted = {
+            5: day.day_off,
+            8: day.extra_hours != time(0, 0),
+            9: day.time_off != time(0, 0),
+            10: bool(day.notes),
+        }
+        values = [day.date, day.entry_time_morning, day.exit_time_morning, day.entry_time_afternoon,
+                  day.exit_time_afternoon, "Yes" if day.day_off else "No", "Yes" if day.national_holiday else "No",
+                  "Yes" if day.weekend else "No", day.extra_hours, day.time_off, day.notes]
+        fills = [HIGHLIGHT_FILL if highlighted.get(col) else row_fill for col in range(len(values))]
+        sheet1.append([value if fill is None else styles.cell(value, fill=fill) for value, fill in zip(values, fills)])
+
+    if employeeOverview:
+        sheet2 = workbook.create_sheet("Osservazione mensile")
+        sheet2.column_dimensions["A"].width = 26
+        header = CellStyles(sheet2)
+        sheet2.append([header.cell("Metric", font=HEADER_FONT), header.cell("Value", font=HEADER_FONT)])
+        sheet2.append(["Is Submitted", "Yes" if employeeOverview["isSubmitted"] else "No"])
+        sheet2.append(["Total Worked Hours", employeeOverview["totalWorkedHoursInMonth"]])
+        sheet2.append(["Total Extra Hours", employeeOverview["totalExtraHoursInMonth"]])
+        sheet2.append(["Total Off Hours", employeeOverview["totalOffHoursInMonth"]])
+        sheet2.append(["Total Off Days", employeeOverview["totalOffDaysInMonth"]])
+        sheet2.append(["Total Expected Working Hours", employeeOverview["totalExpectedWorkingHours"]])
+        sheet2.append(["Notes", employeeOverview["notes"]])
+
+    return save_workbook(workbook)
+
+
+def modified_day_row(day: AdminModifiedPresence) -> list:
+    """The cells of a day in the modified export, also printed by pdf_renderer."""
+    Notes = ''
+    if day.modified_day_off:
+        Notes += "FERIE "
+    if day.modified_national_holiday:
+        Notes += "FESTIVITÀ NAZIONALE "
+    if day.modified_extra_hours.isoformat() != '00:00:00':
+        Notes += f"STRAORDINARIO:{day.modified_extra_hours.strftime('%H:%M')} "
+    if day.modified_time_off.isoformat() != '00:00:00':
+        Notes += f"PERMESSO:{day.modified_time_off.strftime('%H:%M')} "
+    if day.modified_illness:
+        Notes += f"Malattia:{day.modified_illness} "
+    if day.modified_notes:
+        Notes += day.modified_notes
+
+    def format_time(t: time) -> str:
+        return "" if t.strftime("%H:%M") == "00:00" else t.strftime("%H:%M")
+
+    workedHoursInDay = calculate_hours_per_day(day.modified_entry_time_morning,
+                                               day.modified_exit_time_morning,
+                                               day.modified_entry_time_afternoon,
+                                               day.modified_exit_time_afternoon)
+    return [
+        day.date.day,
+        format_time(day.modified_entry_time_morning),
+        format_time(day.modified_exit_time_morning),
+        format_time(day.modified_entry_time_afternoon),
+        format_time(day.modified_exit_time_afternoon),
+        workedHoursInDay,
+        Notes
+    ]
+
+
+def modified_day_fill(day: AdminModifiedPresence) -> Optional[PatternFill]:
+    if day.modified_national_holiday:
+        return FESTIVITA_FILL
+    if day.modified_weekend or day.modified_day_off:
+        return MODIFIED_WEEKEND_FILL
+    return None
+
+
+def write_only_excel_modified(presence_data: [DailyPresence], employee: UserBase) -> BytesIO:
+    workbook = Workbook(write_only=True)
+    sheet1 = workbook.create_sheet("Presenze mensile")
+    sheet1.page_setup.fitToWidth = 1
+    sheet1.page_setup.fitToHeight = 0
+    sheet1.page_margins = PageMargins(top=0.5, bottom=0.5, left=0.3, right=0.3)
+    # Columns are written before the first row in write-only mode
+    for column, width in MODIFIED_WIDTHS.items():
+        sheet1.column_dimensions[column].width = width
+
+    styles = CellStyles(sheet1)
+
+    img = Image(BytesIO(LOGO))
+    img.anchor = 'A1'
+    sheet1.add_image(img)
+    for _ in range(6):
+        sheet1.append([])
+
+    def label_row(first_label, first_value, second_label, second_value):
+        return [styles.cell(first_label, font=BOLD_FONT, alignment=CENTER_ALIGNMENT),
+                styles.cell(first_value, alignment=CENTER_ALIGNMENT),
+                styles.cell(second_label, font=BOLD_FONT, alignment=CENTER_ALIGNMENT),
+                second_value]
+
+    sheet1.append(label_row("Cognome:", employee.surname, "Nome", employee.name))
+    sheet1.append([])
+    sheet1.append([])
+    sheet1.append(label_row("Anno", presence_data[0].date.year, "Mese", presence_data[0].date.month))
+    sheet1.append([])
+    sheet1.append([])
+
+    sheet1.append([styles.cell(title, font=BOLD_FONT, alignment=CENTER_ALIGNMENT, border=THIN_BORDER)
+                   for title in MODIFIED_HEADER])
+
+    for day in presence_data:
+        sheet1.append([styles.cell(value, fill=modified_day_fill(day), alignment=CENTER_ALIGNMENT, border=THIN_BORDER)
+                       for value in modified_day_row(day)])
+
+    return save_workbook(workbook)
+
+
+def create_excel_original(presence_data: [DailyPresence], employeeOverview: Dict=Optional, write_only: bool = True):
+    if write_only:
+        return write_only_excel_original(presence_data, employeeOverview)
     # Create Excel workbook
     workbook = Workbook()
     sheet1 = workbook.active
@@ -220,7 +741,9 @@ def create_excel_original(presence_data: [DailyPresence], employeeOverview: Dict
     return excel_output
 
 
-def create_excel_modified(presence_data: [DailyPresence], employee: UserBase):
+def create_excel_modified(presence_data: [DailyPresence], employee: UserBase, write_only: bool = True):
+    if write_only:
+        return write_only_excel_modified(presence_data, employee)
 
     workbook = Workbook()
     sheet1 = workbook.active
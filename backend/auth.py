@@ -1,16 +1,26 @@
 
+import asyncio
+import hashlib
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
 from passlib.context import CryptContext
+from sqlalchemy import delete, inspect, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from fastapi import Depends, HTTPException, status, BackgroundTasks
+from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 
-from database import get_db
-from models import User
+from database import get_async_db
+from models import User, UserSession
 from serialization import TokenData, UserUpdate
 from config import settings
-from CRUD import get_user_by_username, send_email_to_employee
+from CRUD import get_user_by_username_async, get_token_version_async
+from outbox import enqueue_emails
 import random
 import smtplib
 from email.mime.text import MIMEText
@@ -23,12 +33,93 @@ ALGORITHM = settings.ALGORITHM
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
 
 # Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.BCRYPT_ROUNDS)
 
 # OAuth2 scheme
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 
+class TTLCache:
+    """Bounded LRU whose entries expire ttl seconds after they were stored."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()  # invalidated from sync endpoints running in the threadpool too
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        if self.ttl <= 0 or self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Column values of the users resolved from tokens, keyed by the token subject (work_email)
+principal_cache = TTLCache(settings.PRINCIPAL_CACHE_SIZE, settings.PRINCIPAL_CACHE_TTL_SECONDS)
+# Current token_version per user id, MISSING_USER_VERSION once the user is gone
+token_versions = TTLCache(settings.PRINCIPAL_CACHE_SIZE, settings.PRINCIPAL_CACHE_TTL_SECONDS)
+MISSING_USER_VERSION = -1
+
+
+class PasswordHasher:
+    """Runs bcrypt on a bounded thread pool so it never blocks the event loop (bcrypt releases the GIL)."""
+
+    def __init__(self, workers: int, queue_limit: int):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    async def run(self, fn, *args):
+        with self._lock:
+            if self._pending >= self.workers + self.queue_limit:
+                raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                    detail="Too many logins in progress, please retry shortly",
+                                    headers={"Retry-After": "1"})
+            self._pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self.run(pwd_context.hash, password)
+
+    async def verify_and_update(self, password: str, hashed_password: str):
+        """(verified, new hash or None when the stored hash already uses the current parameters)"""
+        return await self.run(pwd_context.verify_and_update, password, hashed_password)
+
+
+password_hasher = PasswordHasher(settings.PASSWORD_HASH_WORKERS, settings.PASSWORD_HASH_QUEUE_LIMIT)
+
+
 # Utility functions
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
@@ -38,6 +129,34 @@ def get_password_hash(password):
     return pwd_context.hash(password)
 
 
+async def get_password_hash_async(password):
+    return await password_hasher.hash(password)
+
+
+def token_claims(user: User) -> dict:
+    """Claims that let get_current_user authenticate the user without loading it."""
+    return {"sub": user.work_email, "id": user.id, "role": user.role, "active": bool(user.is_active),
+            "ver": user.token_version or 0}
+
+
+def user_values(user: User) -> dict:
+    return {attr.key: getattr(user, attr.key) for attr in inspect(User).column_attrs}
+
+
+def bump_token_version(user: User):
+    """Revokes every token issued to the user so far, takes effect once committed."""
+    user.token_version = (user.token_version or 0) + 1
+
+
+async def get_token_version(db: AsyncSession, user_id: int) -> int:
+    version = token_versions.get(user_id)
+    if version is None:
+        version = await get_token_version_async(db, user_id)
+        version = MISSING_USER_VERSION if version is None else version
+        token_versions.put(user_id, version)
+    return version
+
+
 def create_access_token(data: dict, expires_delta: timedelta = None):
     to_encode = data.copy()
     if expires_delta:
@@ -49,16 +168,67 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     return encoded_jwt
 
 
-def authenticate_user(db: Session, work_email: str, password: str):
-    user = get_user_by_username(db, work_email)
+def refresh_token_hash(refresh_token: str) -> str:
+    # The token is 256 random bits, a plain digest is enough to keep it out of the table
+    return hashlib.sha256(refresh_token.encode()).hexdigest()
+
+
+async def create_refresh_session(db: AsyncSession, user: User) -> str:
+    """Opens a login session for user and returns its refresh token."""
+    now = datetime.utcnow()
+    refresh_token = secrets.token_urlsafe(32)
+    await db.execute(delete(UserSession).where(UserSession.user_id == user.id, UserSession.expires_at <= now))
+    db.add(UserSession(user_id=user.id, token_hash=refresh_token_hash(refresh_token), token_version=user.token_version or 0,
+                       expires_at=now + timedelta(hours=settings.REFRESH_TOKEN_EXPIRE_HOURS)))
+    await db.commit()
+    return refresh_token
+
+
+async def rotate_refresh_session(db: AsyncSession, refresh_token: str):
+    """(user, new refresh token) for a valid refresh token, which stops working; (None, None) otherwise."""
+    new_refresh_token = secrets.token_urlsafe(32)
+    # Swapping the hash in one statement means only one of two concurrent refreshes wins
+    session = (await db.execute(
+        update(UserSession)
+        .where(UserSession.token_hash == refresh_token_hash(refresh_token), UserSession.expires_at > datetime.utcnow())
+        .values(token_hash=refresh_token_hash(new_refresh_token))
+        .returning(UserSession.id, UserSession.user_id, UserSession.token_version)
+    )).first()
+    if session is None:
+        return None, None
+    user = await db.get(User, session.user_id)
+    if user is None or not user.is_active or user.token_version != session.token_version:
+        # Revoked by a password change, deactivation or a change of role or email
+        await db.execute(delete(UserSession).where(UserSession.id == session.id))
+        await db.commit()
+        return None, None
+    await db.commit()
+    return user, new_refresh_token
+
+
+async def revoke_refresh_session(db: AsyncSession, refresh_token: str):
+    await db.execute(delete(UserSession).where(UserSession.token_hash == refresh_token_hash(refresh_token)))
+    await db.commit()
+
+
+async def authenticate_user(db: AsyncSession, work_email: str, password: str):
+    user = await get_user_by_username_async(db, work_email)
     if not user:
         return False
-    if not verify_password(password, user.password):
+    # Ends the read transaction so the connection goes back to the pool while bcrypt runs
+    await db.commit()
+    verified, new_hash = await password_hasher.verify_and_update(password, user.password)
+    if not verified:
         return False
+    if new_hash:
+        # Stored with outdated parameters, upgrade it now that the plain password is known
+        user.password = new_hash
+        await db.commit()
+        principal_cache.invalidate(user.work_email)
     return user
 
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -69,13 +239,32 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
-        token_data = TokenData(work_email=username)
+        token_data = TokenData(work_email=username, user_id=payload.get("id"), role=payload.get("role"),
+                               active=payload.get("active"), token_version=payload.get("ver"))
     except JWTError:
         raise credentials_exception
-    user = get_user_by_username(db, work_email=token_data.work_email)
-    if user is None:
+
+    if settings.AUTH_TRUST_TOKEN_CLAIMS and token_data.user_id is not None:
+        # The token says who the user is, only whether it was revoked since has to be checked
+        if not token_data.active or await get_token_version(db, token_data.user_id) != token_data.token_version:
+            raise credentials_exception
+        # Only the claimed columns are set, load the user explicitly when more is needed
+        return User(id=token_data.user_id, work_email=token_data.work_email, role=token_data.role,
+                    is_active=True, token_version=token_data.token_version)
+
+    values = principal_cache.get(token_data.work_email)
+    if values is None:
+        user = await get_user_by_username_async(db, work_email=token_data.work_email)
+        if user is None:
+            raise credentials_exception
+        values = user_values(user)
+        principal_cache.put(token_data.work_email, values)
+    if not values["is_active"]:
+        raise credentials_exception
+    if token_data.token_version is not None and token_data.token_version != values["token_version"]:
         raise credentials_exception
-    return user
+    # A fresh transient User per request, so no instance is shared between sessions
+    return User(**values)
 
 
 def get_all_users(db: Session):
@@ -90,28 +279,36 @@ def get_all_employees(db: Session):
     return db_users
 
 
-def update_user_db(db: Session, user: UserUpdate, background_tasks: BackgroundTasks):
-    db_user = db.query(User).filter(User.id == user.id).first()
+async def get_all_employees_async(db: AsyncSession):
+    db_users = await db.scalars(select(User).where(User.role == 'employee'))
+
+    return db_users.all()
+
+
+async def update_user_db(db: AsyncSession, user: UserUpdate):
+    db_user = await db.get(User, user.id)
     if db_user:
+        previous_claims = token_claims(db_user)
         update_data = user.dict(exclude_unset=True)
         for var, value in update_data.items():
             if value and var == "password":
-                value = get_password_hash(value)
+                value = await get_password_hash_async(value)
             if value and var == "iban":
                         text = f"The IBAN of <b>{db_user.name}</b> <b>{db_user.surname}</b> has been changed. <br><br> The new IBAN is: <b>{value.upper()}</b>"
-                        email_sender = os.getenv("SMTP_USERNAME")
-                        background_tasks.add_task(send_email_to_employee,
-                                                  receiver_email=email_sender,
-                                                  subject="IBAN MODIFICATION",
-                                                  body=text)
+                        # Queued in the same transaction as the change itself
+                        enqueue_emails(db, [settings.SMTP_USERNAME], subject="IBAN MODIFICATION", body=text)
                         value = value.upper()
             if value and var == "name":
                 value = value.capitalize() 
             if value and var == "surname":
                 value = value.capitalize()                 
             setattr(db_user, var, value)
-        db.commit()
-        db.refresh(db_user)
+        if update_data.get("password") or token_claims(db_user) != previous_claims:
+            # Tokens issued so far carry a stale email, role or active flag, or predate the new password
+            bump_token_version(db_user)
+        await db.commit()
+        principal_cache.invalidate(previous_claims["sub"], db_user.work_email)
+        token_versions.invalidate(db_user.id)
     else:
         return None
     return db_user
@@ -122,8 +319,11 @@ def delete_user_from_db(db: Session, user_id: int):
     if not db_user:
         return False
 
+    work_email = db_user.work_email
     db.delete(db_user)
     db.commit()
+    principal_cache.invalidate(work_email)
+    token_versions.invalidate(user_id)
     return True
 
 
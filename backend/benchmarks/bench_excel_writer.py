@@ -0,0 +1,112 @@
+"""Per-workbook time and memory of the Excel exports, normal openpyxl workbooks against write-only ones.
+
+    cd backend
+    python benchmarks/bench_excel_writer.py
+
+Builds BENCH_WORKBOOKS month workbooks with create_excel_original and create_excel_modified, with
+write_only=False (the builders as they were) and write_only=True, reporting the mean time and the
+peak memory traced while building one. Before timing, both outputs are loaded back and compared
+cell by cell (values, fonts, fills, alignment, borders), along with column widths, page setup and
+the logo, so the write-only builders are known to render the same sheets.
+"""
+import os
+import sys
+import time as timer
+import tracemalloc
+from datetime import date, time, timedelta
+from io import BytesIO
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from openpyxl import load_workbook
+
+from CRUD import create_excel_modified, create_excel_original, format_month_overview
+from models import AdminModifiedPresence, DailyPresence
+
+
+WORKBOOKS = int(os.getenv("BENCH_WORKBOOKS", "200"))
+YEAR, MONTH = 2024, 5
+EMPLOYEE = SimpleNamespace(name="Mario", surname="Rossi")
+
+
+def month_days():
+    day = date(YEAR, MONTH, 1)
+    while day.month == MONTH:
+        yield day
+        day += timedelta(days=1)
+
+
+def day_values(day):
+    """A month with every kind of day the exports colour differently."""
+    weekend = day.weekday() >= 5
+    day_off = day.day in (6, 7)
+    holiday = day.day == 1
+    working = not (weekend or day_off or holiday)
+    return dict(
+        weekend=weekend, day_off=day_off, national_holiday=holiday,
+        illness="influenza" if day.day == 14 else "", notes="visita medica" if day.day == 9 else "",
+        entry_time_morning=time(9) if working else time(0), exit_time_morning=time(13) if working else time(0),
+        entry_time_afternoon=time(14) if working else time(0), exit_time_afternoon=time(18) if working else time(0),
+        time_off=time(2) if day.day == 21 else time(0), extra_hours=time(1, 30) if day.day == 22 else time(0))
+
+
+def original_days():
+    return [DailyPresence(employee_id=1, date=day, **day_values(day)) for day in month_days()]
+
+
+def modified_days():
+    return [AdminModifiedPresence(employee_id=1, date=day,
+                                  **{f"modified_{name}": value for name, value in day_values(day).items()})
+            for day in month_days()]
+
+
+def rendering(xlsx: bytes):
+    """What a reader sees of a workbook."""
+    workbook = load_workbook(BytesIO(xlsx))
+    sheets = []
+    for sheet in workbook.worksheets:
+        cells = {}
+        for row in sheet.iter_rows():
+            for cell in row:
+                style = (cell.font.b, cell.font.sz, cell.fill.fill_type, cell.fill.fgColor.rgb,
+                         cell.alignment.horizontal, cell.alignment.vertical,
+                         tuple(getattr(cell.border, side).style for side in ("left", "right", "top", "bottom")))
+                if cell.value is not None or style != (False, 11.0, None, "00000000", None, None, (None,) * 4):
+                    cells[cell.coordinate] = (cell.value, style)
+        widths = {key: dimension.width for key, dimension in sheet.column_dimensions.items() if dimension.width}
+        images = [(image.width, image.height, image._data()) for image in sheet._images]
+        sheets.append((sheet.title, cells, widths, images, sheet.page_setup.fitToWidth,
+                       sheet.page_setup.fitToHeight, tuple(vars(sheet.page_margins).items())))
+    return sheets
+
+
+def measure(build):
+    build()  # Warm-up
+    tracemalloc.start()
+    build()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    started = timer.perf_counter()
+    for _ in range(WORKBOOKS):
+        build()
+    return (timer.perf_counter() - started) / WORKBOOKS, peak
+
+
+def main():
+    original, modified = original_days(), modified_days()
+    overview = format_month_overview(None)
+    builders = {
+        "original": lambda write_only: create_excel_original(original, overview, write_only=write_only),
+        "modified": lambda write_only: create_excel_modified(modified, EMPLOYEE, write_only=write_only),
+    }
+    for name, build in builders.items():
+        assert rendering(build(False).getvalue()) == rendering(build(True).getvalue()), \
+            f"{name}: the write-only workbook renders differently"
+        for label, write_only in (("before", False), ("after", True)):
+            elapsed, peak = measure(lambda: build(write_only))
+            print(f"{name:9} {label:7} {elapsed * 1000:7.2f} ms/workbook | peak traced {peak / 2 ** 10:8.1f} KiB")
+
+
+if __name__ == "__main__":
+    main()
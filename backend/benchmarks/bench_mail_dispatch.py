@@ -0,0 +1,120 @@
+"""Delivery time of a bulk email to 1,000 recipients against a local aiosmtpd server.
+
+    pip install aiosmtpd
+    cd backend
+    python benchmarks/bench_mail_dispatch.py
+
+The server answers every command after BENCH_SMTP_RTT_MS, as a remote server would, requires
+AUTH, and refuses a recipient with a transient 451 at BENCH_SMTP_FAILURE_RATE. "before" sends
+one message per connection in sequence, like the background tasks of the bulk endpoints used
+to; "after" delivers them the way mail_worker.py does, MailDispatcher.deliver_many over batches
+of OUTBOX_BATCH_SIZE.
+"""
+import asyncio
+import logging
+import os
+import random
+import smtplib
+import sys
+import time as timer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiosmtpd.controller import Controller
+from aiosmtpd.smtp import AuthResult
+
+from config import settings
+from mail import MailDispatcher, SMTPConnectionPool, build_message
+
+logging.getLogger("mail.log").setLevel(logging.ERROR)  # aiosmtpd warns about its own login_data on every AUTH
+
+
+RECIPIENTS = int(os.getenv("BENCH_RECIPIENTS", "1000"))
+RTT = float(os.getenv("BENCH_SMTP_RTT_MS", "5")) / 1000
+FAILURE_RATE = float(os.getenv("BENCH_SMTP_FAILURE_RATE", "0.01"))
+POOL_SIZE = int(os.getenv("SMTP_POOL_SIZE", "4"))
+HOST, PORT = "127.0.0.1", int(os.getenv("BENCH_SMTP_PORT", "8025"))
+SENDER, PASSWORD = "presenze@bench.local", "x"
+
+
+class SlowHandler:
+    def __init__(self):
+        self.delivered = set()
+        self.connections = 0
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        self.connections += 1
+        await asyncio.sleep(RTT)
+        session.host_name = hostname
+        return responses
+
+    async def handle_MAIL(self, server, session, envelope, address, mail_options):
+        await asyncio.sleep(RTT)
+        envelope.mail_from = address
+        return "250 OK"
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        await asyncio.sleep(RTT)
+        if random.random() < FAILURE_RATE:
+            return "451 Try again later"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        await asyncio.sleep(RTT)
+        self.delivered.update(envelope.rcpt_tos)
+        return "250 Message accepted"
+
+
+def authenticate(server, session, envelope, mechanism, auth_data):
+    return AuthResult(success=True)
+
+
+def legacy_send(receiver_email, subject, body):
+    """The previous send_email_to_employee, without SSL for the local server."""
+    try:
+        with smtplib.SMTP(HOST, PORT) as server:
+            server.login(SENDER, PASSWORD)
+            server.sendmail(SENDER, receiver_email, build_message(SENDER, receiver_email, subject, body).as_string())
+    except Exception as e:
+        print(f"Failed to send email to {receiver_email}: {e}")
+
+
+def deliver_batches(dispatcher, receivers, subject, body):
+    for start in range(0, len(receivers), settings.OUTBOX_BATCH_SIZE):
+        batch = receivers[start:start + settings.OUTBOX_BATCH_SIZE]
+        errors = dispatcher.deliver_many([(receiver, subject, body) for receiver in batch])
+        for receiver, error in zip(batch, errors):
+            if error is not None:
+                print(f"Failed to send email to {receiver}: {error}")
+
+
+def run(label, handler, send_all, receivers):
+    handler.delivered.clear()
+    handler.connections = 0
+    started = timer.perf_counter()
+    send_all(receivers)
+    elapsed = timer.perf_counter() - started
+    print(f"{label:<7} delivered={len(handler.delivered):>5}/{len(receivers)}  connections={handler.connections:>5}  "
+          f"time={elapsed:7.2f} s  {len(receivers) / elapsed:7.1f} mails/s")
+
+
+def main():
+    handler = SlowHandler()
+    controller = Controller(handler, hostname=HOST, port=PORT, authenticator=authenticate, auth_require_tls=False)
+    controller.start()
+    receivers = [f"employee{i}@bench.local" for i in range(RECIPIENTS)]
+    subject, body = "Presenze", "<p>Please submit your presence for this month.</p>"
+    try:
+        run("before", handler, lambda rs: [legacy_send(r, subject, body) for r in rs], receivers)
+        pool = SMTPConnectionPool(HOST, PORT, False, SENDER, PASSWORD, POOL_SIZE, timeout=30, idle_seconds=30,
+                                  max_messages=100)
+        dispatcher = MailDispatcher(pool, SENDER, max_retries=3, retry_backoff=0.05)
+        run("after", handler, lambda rs: deliver_batches(dispatcher, rs, subject, body), receivers)
+        dispatcher.close()
+    finally:
+        controller.stop()
+
+
+if __name__ == "__main__":
+    main()
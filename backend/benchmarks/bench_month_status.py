@@ -0,0 +1,88 @@
+"""Queries and latency of the month submission status lists as headcount grows.
+
+Compares the per-employee has_submitted_presence loop with get_month_submission_status.
+
+    cd backend
+    python benchmarks/bench_month_status.py
+"""
+import os
+import statistics
+import sys
+import tempfile
+import time as timer
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from auth import get_all_employees
+from CRUD import get_month_submission_status, has_submitted_presence
+from models import Base, User, DailyPresence
+
+
+DATABASE_URL = os.getenv("BENCH_DATABASE_URL", "sqlite:///" + os.path.join(tempfile.gettempdir(), "bench_presenza.db"))
+ITERATIONS = int(os.getenv("BENCH_ITERATIONS", "20"))
+HEADCOUNTS = (10, 100, 1000)
+
+
+def legacy_status(db, year, month):
+    missing_employees = []
+    for employee in get_all_employees(db):
+        if not has_submitted_presence(employee.id, year=year, month=month, db=db):
+            missing_employees.append(employee)
+    return missing_employees
+
+
+def seed(SessionLocal, headcount):
+    with SessionLocal() as db:
+        db.query(DailyPresence).delete()
+        db.query(User).delete()
+        for i in range(headcount):
+            user = User(id=i + 1, name="Bench", surname=str(i), job_start_date=date(2020, 1, 1), phone_number="0",
+                        work_email=f"{i}@bench.local", role="employee", password="x")
+            db.add(user)
+            # Two thirds of the company submitted the month
+            if i % 3:
+                day = date(2025, 1, 1)
+                while day.month == 1:
+                    db.add(DailyPresence(employee_id=user.id, date=day))
+                    day += timedelta(days=1)
+        db.commit()
+
+
+def measure(label, status, SessionLocal, counter):
+    latencies, queries = [], []
+    for _ in range(ITERATIONS):
+        with SessionLocal() as db:
+            counter["n"] = 0
+            started = timer.perf_counter()
+            status(db, "2025", "01")
+            latencies.append(timer.perf_counter() - started)
+            queries.append(counter["n"])
+    p95 = statistics.quantiles(latencies, n=20)[18] * 1000
+    print(f"  {label:<7} queries={max(queries):>5}  p50={statistics.median(latencies) * 1000:8.2f} ms  p95={p95:8.2f} ms")
+
+
+def main():
+    engine = create_engine(DATABASE_URL)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    counter = {"n": 0}
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def count_statement(*args):
+        counter["n"] += 1
+
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    for headcount in HEADCOUNTS:
+        seed(SessionLocal, headcount)
+        print(f"{headcount} employees")
+        measure("before", legacy_status, SessionLocal, counter)
+        measure("after", get_month_submission_status, SessionLocal, counter)
+    Base.metadata.drop_all(engine)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Per-PDF latency of the presence export: one soffice per PDF against the converter pool.
+
+Needs LibreOffice and python3-uno, as in the backend image:
+
+    cd backend
+    python benchmarks/bench_pdf_conversion.py
+
+Converts BENCH_PDFS workbooks from create_excel_modified, from BENCH_CLIENTS threads at once.
+"before" runs soffice --convert-to for each of them, "after" goes through a warmed-up
+ConverterPool of BENCH_CONVERTERS processes. "native" draws the same timesheets with
+pdf_renderer straight from the presence rows, it needs no LibreOffice and runs alone with
+BENCH_NATIVE_ONLY=1.
+"""
+import os
+import statistics
+import sys
+import time as timer
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, time, timedelta
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import settings
+from CRUD import create_excel_modified
+from models import AdminModifiedPresence
+from pdf_converter import ConverterPool, convert_once
+from pdf_renderer import render_modified_pdf
+
+
+PDFS = int(os.getenv("BENCH_PDFS", "40"))
+CLIENTS = int(os.getenv("BENCH_CLIENTS", "4"))
+CONVERTERS = int(os.getenv("BENCH_CONVERTERS", "4"))
+NATIVE_ONLY = os.getenv("BENCH_NATIVE_ONLY", "0") == "1"
+EMPLOYEE = SimpleNamespace(name="Mario", surname="Rossi")
+
+
+def sample_days() -> list:
+    days = []
+    day = date(2024, 5, 1)
+    while day.month == 5:
+        weekend = day.weekday() >= 5
+        days.append(AdminModifiedPresence(
+            employee_id=1, date=day, modified_weekend=weekend, modified_day_off=False,
+            modified_national_holiday=False, modified_illness=None, modified_notes="",
+            modified_entry_time_morning=time(0) if weekend else time(9),
+            modified_exit_time_morning=time(0) if weekend else time(13),
+            modified_entry_time_afternoon=time(0) if weekend else time(14),
+            modified_exit_time_afternoon=time(0) if weekend else time(18),
+            modified_time_off=time(0), modified_extra_hours=time(0)))
+        day += timedelta(days=1)
+    return days
+
+
+def sample_workbook() -> bytes:
+    return create_excel_modified(sample_days(), EMPLOYEE).getvalue()
+
+
+def run(label, convert, xlsx):
+    def timed(_):
+        started = timer.perf_counter()
+        pdf = convert(xlsx)
+        assert pdf.startswith(b"%PDF")
+        return timer.perf_counter() - started
+
+    started = timer.perf_counter()
+    with ThreadPoolExecutor(max_workers=CLIENTS) as executor:
+        latencies = sorted(executor.map(timed, range(PDFS)))
+    elapsed = timer.perf_counter() - started
+    print(f"{label:7} {PDFS} PDFs in {elapsed:6.1f} s | p50 {statistics.median(latencies) * 1000:6.0f} ms "
+          f"| p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:6.0f} ms | max {latencies[-1] * 1000:6.0f} ms")
+
+
+def main():
+    run("native", lambda days: render_modified_pdf(days, EMPLOYEE), sample_days())
+    if NATIVE_ONLY:
+        return
+
+    xlsx = sample_workbook()
+    run("before", lambda data: convert_once(data, settings.LIBREOFFICE_BINARY, settings.PDF_CONVERT_TIMEOUT_SECONDS),
+        xlsx)
+
+    pool = ConverterPool(CONVERTERS, settings.LIBREOFFICE_PYTHON, settings.LIBREOFFICE_BINARY,
+                         settings.PDF_CONVERT_TIMEOUT_SECONDS, settings.PDF_QUEUE_TIMEOUT_SECONDS,
+                         settings.PDF_CONVERTER_START_TIMEOUT_SECONDS, settings.PDF_CONVERTER_MAX_JOBS,
+                         settings.PDF_CONVERTER_HEALTH_CHECK_SECONDS)
+    try:
+        started = timer.perf_counter()
+        with ThreadPoolExecutor(max_workers=CONVERTERS) as executor:
+            list(executor.map(pool.convert, [xlsx] * CONVERTERS))
+        print(f"pool of {CONVERTERS} started in {timer.perf_counter() - started:.1f} s")
+        run("after", pool.convert, xlsx)
+    finally:
+        pool.close()
+
+
+if __name__ == "__main__":
+    main()
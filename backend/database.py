@@ -1,14 +1,151 @@
 import os
-from sqlalchemy import create_engine
+import time
+from fastapi import Request
+from uuid import uuid4
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool
+
+from config import settings
 
 
 SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL",
                                     "postgresql://postgres:Storelink2024@db:5432/presenza")
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+
+def async_database_url(url: str) -> str:
+    # Same database, async driver: asyncpg for Postgres, aiosqlite for local sqlite files
+    for sync_prefix, async_prefix in (("postgresql+psycopg2://", "postgresql+asyncpg://"),
+                                      ("postgresql://", "postgresql+asyncpg://"),
+                                      ("sqlite://", "sqlite+aiosqlite://")):
+        if url.startswith(sync_prefix):
+            return async_prefix + url[len(sync_prefix):]
+    return url
+
+
+class PoolWaitStats:
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, waited: float, timed_out: bool = False):
+        if timed_out:
+            self.timeouts += 1
+        else:
+            self.checkouts += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+
+
+class TimedPoolMixin:
+    """Measures how long sessions wait for a pooled connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_stats = PoolWaitStats()
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            self.wait_stats.record(time.perf_counter() - started, timed_out=True)
+            raise
+        self.wait_stats.record(time.perf_counter() - started)
+        return connection
+
+
+class TimedQueuePool(TimedPoolMixin, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(TimedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def engine_options(url: str, is_async: bool = False) -> dict:
+    if not url.startswith("postgresql"):
+        # sqlite is only used locally, keep SQLAlchemy's defaults
+        return {}
+
+    options = {"pool_pre_ping": settings.DB_POOL_PRE_PING}
+    if settings.DB_POOL_MODE in ("null", "pgbouncer"):
+        options["poolclass"] = NullPool
+    else:
+        options.update(poolclass=TimedAsyncQueuePool if is_async else TimedQueuePool,
+                       pool_size=settings.DB_POOL_SIZE,
+                       max_overflow=settings.DB_MAX_OVERFLOW,
+                       pool_timeout=settings.DB_POOL_TIMEOUT,
+                       pool_recycle=settings.DB_POOL_RECYCLE)
+
+    connect_args = {}
+    if settings.DB_POOL_MODE == "pgbouncer":
+        # Named prepared statements do not survive transaction pooling
+        if is_async:
+            connect_args.update(statement_cache_size=0,
+                                prepared_statement_cache_size=0,
+                                prepared_statement_name_func=lambda: f"__asyncpg_{uuid4()}__")
+    elif settings.DB_STATEMENT_TIMEOUT_MS:
+        if is_async:
+            connect_args["server_settings"] = {"statement_timeout": str(settings.DB_STATEMENT_TIMEOUT_MS)}
+        else:
+            connect_args["options"] = f"-c statement_timeout={settings.DB_STATEMENT_TIMEOUT_MS}"
+    options["connect_args"] = connect_args
+    return options
+
+
+def set_transaction_statement_timeout(sync_engine):
+    # Startup parameters are not forwarded by PgBouncer, so the timeout is set per transaction
+    @event.listens_for(sync_engine, "begin")
+    def statement_timeout(conn):
+        conn.exec_driver_sql(f"SET LOCAL statement_timeout = {int(settings.DB_STATEMENT_TIMEOUT_MS)}")
+
+
+def pool_status(engine) -> dict:
+    pool = engine.pool
+    status = {"pool": type(pool).__name__, "mode": settings.DB_POOL_MODE}
+    if isinstance(pool, QueuePool):
+        status.update(size=pool.size(),
+                      checked_out=pool.checkedout(),
+                      checked_in=pool.checkedin(),
+                      overflow=max(pool.overflow(), 0),
+                      max_overflow=settings.DB_MAX_OVERFLOW)
+    wait_stats = getattr(pool, "wait_stats", None)
+    if wait_stats:
+        status.update(checkouts=wait_stats.checkouts,
+                      timeouts=wait_stats.timeouts,
+                      avg_wait_ms=round(wait_stats.total_wait / max(wait_stats.checkouts + wait_stats.timeouts, 1) * 1000, 3),
+                      max_wait_ms=round(wait_stats.max_wait * 1000, 3))
+    return status
+
+
+ASYNC_SQLALCHEMY_DATABASE_URL = async_database_url(SQLALCHEMY_DATABASE_URL)
+
+engine = create_engine(SQLALCHEMY_DATABASE_URL, **engine_options(SQLALCHEMY_DATABASE_URL))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL, **engine_options(ASYNC_SQLALCHEMY_DATABASE_URL, is_async=True))
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+if settings.DATABASE_REPLICA_URL:
+    read_engine = create_engine(settings.DATABASE_REPLICA_URL, **engine_options(settings.DATABASE_REPLICA_URL))
+else:
+    read_engine = engine
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+
+# Clients that must see their own just-committed writes send this header to read from the primary
+READ_PRIMARY_HEADER = "X-Read-Primary"
+
+if settings.DB_POOL_MODE == "pgbouncer" and settings.DB_STATEMENT_TIMEOUT_MS and SQLALCHEMY_DATABASE_URL.startswith("postgresql"):
+    set_transaction_statement_timeout(engine)
+    set_transaction_statement_timeout(async_engine.sync_engine)
+    if read_engine is not engine:
+        set_transaction_statement_timeout(read_engine)
+
 
 def get_db():
     db = SessionLocal()
@@ -16,3 +153,21 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+def read_session_factory(request: Request) -> sessionmaker:
+    read_primary = request.headers.get(READ_PRIMARY_HEADER, "").lower() in ("1", "true", "yes")
+    return SessionLocal if read_primary else ReadSessionLocal
+
+
+def get_read_db(request: Request):
+    db = read_session_factory(request)()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
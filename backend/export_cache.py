@@ -0,0 +1,123 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from typing import Optional
+
+from config import settings
+
+
+# Part of every key, bump it when the layout of an export changes so older artifacts are not served
+LAYOUT_VERSION = 1
+
+PRUNE_INTERVAL_SECONDS = 60
+
+
+class ExportCache:
+    """Rendered exports on local disk, addressed by the hash of what they were rendered from.
+
+    Keys never change meaning (a write to the month bumps its revision, hence the key), so entries
+    are never invalidated, only pruned, least recently used first, past max_bytes.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._last_prune = 0.0
+        self._prune_lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.directory) and self.max_bytes > 0
+
+    @staticmethod
+    def key(kind: str, employee, year, month, revision: Optional[int]) -> Optional[str]:
+        """None without a revision, such an export cannot be cached."""
+        if revision is None:
+            return None
+        # The name is printed in the export, a rename must not serve the old one
+        parts = (LAYOUT_VERSION, kind, employee.id, employee.name, employee.surname, int(year), int(month), revision)
+        return hashlib.sha256("|".join(map(str, parts)).encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key: str) -> Optional[bytes]:
+        if not self.enabled:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                content = f.read()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)  # Recently used, for pruning
+        except OSError:
+            pass
+        return content
+
+    def put(self, key: str, content: bytes):
+        if not self.enabled:
+            return
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Written aside and renamed, readers in other workers never see a partial file
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+            with os.fdopen(fd, "wb") as f:
+                f.write(content)
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"Could not cache export {key}: {e}")
+            return
+        if time.monotonic() - self._last_prune > PRUNE_INTERVAL_SECONDS:
+            self.prune()
+
+    def get_or_render(self, key: Optional[str], render) -> bytes:
+        content = self.get(key) if key else None
+        if content is None:
+            content = render()
+            if key:
+                self.put(key, content)
+        return content
+
+    def prune(self):
+        if not self._prune_lock.acquire(blocking=False):
+            return
+        try:
+            self._last_prune = time.monotonic()
+            entries = []
+            for root, _, files in os.walk(self.directory):
+                for name in files:
+                    try:
+                        stat = os.stat(os.path.join(root, name))
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, os.path.join(root, name)))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+        finally:
+            self._prune_lock.release()
+
+
+def etag(key: str) -> str:
+    return f'"{key}"'
+
+
+def etag_matches(if_none_match: Optional[str], key: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag(key) in tags or f"W/{etag(key)}" in tags
+
+
+export_cache = ExportCache(settings.EXPORT_CACHE_DIR, settings.EXPORT_CACHE_MAX_BYTES)
@@ -0,0 +1,88 @@
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.orm import Session
+
+from models import ExportJob
+
+
+PENDING, RUNNING, DONE, FAILED = "pending", "running", "done", "failed"
+
+
+def enqueue_export_job(db: Session, year: int, month: int, pdf: bool, requested_by_id: Optional[int]) -> ExportJob:
+    """Queues a month export, or returns the same export if one is already queued or running."""
+    job = db.scalar(select(ExportJob).where(ExportJob.year == year, ExportJob.month == month, ExportJob.pdf == pdf,
+                                            ExportJob.status.in_((PENDING, RUNNING)))
+                    .order_by(ExportJob.created_at).limit(1))
+    if job is None:
+        now = datetime.utcnow()
+        job = ExportJob(id=uuid.uuid4().hex, requested_by_id=requested_by_id, year=year, month=month, pdf=pdf,
+                        status=PENDING, completed=0, attempts=0, available_at=now, created_at=now)
+        db.add(job)
+        db.commit()
+    return job
+
+
+def claim_job(db: Session, lease_seconds: int):
+    """Marks the oldest claimable job as running and returns it, None when there is none."""
+    now = datetime.utcnow()
+    # A running job whose lease ran out belongs to a worker that died
+    claimable = (select(ExportJob.id)
+                 .where(ExportJob.status.in_((PENDING, RUNNING)), ExportJob.available_at <= now)
+                 .order_by(ExportJob.created_at)
+                 .limit(1)
+                 .with_for_update(skip_locked=True))
+    job = db.execute(
+        update(ExportJob)
+        .where(ExportJob.id == claimable.scalar_subquery())
+        .values(status=RUNNING, attempts=ExportJob.attempts + 1, completed=0,
+                available_at=now + timedelta(seconds=lease_seconds))
+        .returning(ExportJob.id, ExportJob.year, ExportJob.month, ExportJob.pdf, ExportJob.attempts)
+        .execution_options(synchronize_session=False)
+    ).first()
+    db.commit()
+    return job
+
+
+def record_progress(db: Session, job_id: str, completed: int, total: int, lease_seconds: int):
+    """Stores the progress and extends the lease of a running job."""
+    db.execute(update(ExportJob).where(ExportJob.id == job_id)
+               .values(completed=completed, total=total,
+                       available_at=datetime.utcnow() + timedelta(seconds=lease_seconds)))
+    db.commit()
+
+
+def finish_job(db: Session, job_id: str, file_path: str):
+    db.execute(update(ExportJob).where(ExportJob.id == job_id)
+               .values(status=DONE, file_path=file_path, finished_at=datetime.utcnow(), error=None))
+    db.commit()
+
+
+def release_job(db: Session, job_id: str, error: Optional[str], retry_after: float, attempts: int, max_attempts: int):
+    """Puts a job that did not finish back in the queue, or fails it once it used its attempts."""
+    now = datetime.utcnow()
+    if error is not None and attempts >= max_attempts:
+        values = dict(status=FAILED, finished_at=now, error=error)
+    else:
+        values = dict(status=PENDING, error=error, available_at=now + timedelta(seconds=retry_after))
+        if error is None:
+            # Interrupted by a shutdown, that does not count as an attempt
+            values["attempts"] = ExportJob.attempts - 1
+    db.execute(update(ExportJob).where(ExportJob.id == job_id).values(**values))
+    db.commit()
+
+
+def purge_finished_jobs(db: Session, retention_hours: int) -> int:
+    """Deletes the jobs finished before the retention period, and their archives."""
+    finished_before = datetime.utcnow() - timedelta(hours=retention_hours)
+    expired = db.execute(delete(ExportJob)
+                         .where(ExportJob.status.in_((DONE, FAILED)), ExportJob.finished_at < finished_before)
+                         .returning(ExportJob.file_path)).scalars().all()
+    db.commit()
+    for file_path in expired:
+        if file_path and os.path.exists(file_path):
+            os.remove(file_path)
+    return len(expired)
@@ -0,0 +1,129 @@
+"""Runs the queued company-wide month exports, next to the API and as many times as needed.
+
+    python export_worker.py           # keeps polling the export jobs
+    python export_worker.py --once    # stops once nothing is claimable
+
+The archives are written to EXPORT_JOB_DIR, which the API must be able to read.
+"""
+import argparse
+import os
+import signal
+import time
+import zipfile
+
+from config import settings
+from CRUD import get_company_month_presences, get_month_submission_status
+from database import SessionLocal
+from export_jobs import claim_job, finish_job, purge_finished_jobs, record_progress, release_job
+from exports import shutdown_render_executor, write_month_archive
+from models import AdminModifiedPresence
+from pdf_converter import pdf_converter_pool
+
+
+PURGE_INTERVAL_SECONDS = 600
+PROGRESS_INTERVAL_SECONDS = 1
+
+
+class Interrupted(Exception):
+    pass
+
+
+class Worker:
+    def __init__(self):
+        self.stopping = False
+
+    def stop(self, *args):
+        # The running export is abandoned at its next employee and put back in the queue
+        self.stopping = True
+
+    def export(self, db, job) -> str:
+        employees, _ = get_month_submission_status(db, job.year, job.month, model=AdminModifiedPresence)
+        presences = get_company_month_presences(db, AdminModifiedPresence, [employee.id for employee in employees],
+                                                job.year, job.month)
+        # Detached, the rows stay loaded through the progress commits and the connection is released
+        db.expunge_all()
+        db.commit()
+        last_update = 0.0
+
+        def progress(completed, total):
+            nonlocal last_update
+            if self.stopping:
+                raise Interrupted()
+            if completed == total or time.monotonic() - last_update > PROGRESS_INTERVAL_SECONDS:
+                record_progress(db, job.id, completed, total, settings.EXPORT_JOB_LEASE_SECONDS)
+                last_update = time.monotonic()
+
+        os.makedirs(settings.EXPORT_JOB_DIR, exist_ok=True)
+        path = os.path.join(settings.EXPORT_JOB_DIR, f"{job.id}.zip")
+        # Written aside, the API never serves a partial archive
+        with open(f"{path}.part", "wb") as f:
+            with zipfile.ZipFile(f, "w", zipfile.ZIP_DEFLATED) as zip_file:
+                record_progress(db, job.id, 0, sum(1 for employee in employees if presences.get(employee.id)),
+                                settings.EXPORT_JOB_LEASE_SECONDS)
+                # Zero-padded, as the months sent to the synchronous exports
+                write_month_archive(zip_file, employees, presences, job.year, f"{job.month:02d}", job.pdf, progress)
+        os.replace(f"{path}.part", path)
+        return path
+
+    def run_job(self, db, job):
+        started = time.monotonic()
+        print(f"Export {job.id} of {job.year}-{job.month:02d} (pdf={job.pdf}), attempt {job.attempts}")
+        if job.attempts > settings.EXPORT_JOB_MAX_ATTEMPTS:
+            # Claimed again after its lease ran out, every time
+            release_job(db, job.id, "The export was interrupted too many times", 0, job.attempts,
+                        settings.EXPORT_JOB_MAX_ATTEMPTS)
+            return
+        try:
+            path = self.export(db, job)
+        except Interrupted:
+            db.rollback()
+            release_job(db, job.id, None, 0, job.attempts, settings.EXPORT_JOB_MAX_ATTEMPTS)
+            print(f"Export {job.id} put back in the queue")
+        except Exception as e:
+            db.rollback()
+            release_job(db, job.id, str(e) or type(e).__name__, settings.EXPORT_JOB_RETRY_BACKOFF_SECONDS,
+                        job.attempts, settings.EXPORT_JOB_MAX_ATTEMPTS)
+            print(f"Export {job.id} failed (attempt {job.attempts}): {e}")
+        else:
+            finish_job(db, job.id, path)
+            print(f"Export {job.id} done in {time.monotonic() - started:.1f} s")
+        finally:
+            part = os.path.join(settings.EXPORT_JOB_DIR, f"{job.id}.zip.part")
+            if os.path.exists(part):
+                os.remove(part)
+
+    def run(self, once: bool = False):
+        last_purge = 0.0
+        try:
+            while not self.stopping:
+                with SessionLocal() as db:
+                    if time.monotonic() - last_purge > PURGE_INTERVAL_SECONDS:
+                        purged = purge_finished_jobs(db, settings.EXPORT_JOB_RETENTION_HOURS)
+                        if purged:
+                            print(f"Removed {purged} expired exports")
+                        last_purge = time.monotonic()
+                    job = claim_job(db, settings.EXPORT_JOB_LEASE_SECONDS)
+                    if job is not None:
+                        self.run_job(db, job)
+                if job is None:
+                    if once:
+                        break
+                    time.sleep(settings.EXPORT_JOB_POLL_SECONDS)
+        finally:
+            shutdown_render_executor()
+            pdf_converter_pool.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the queued month exports")
+    parser.add_argument("--once", action="store_true", help="exit once nothing is claimable")
+    args = parser.parse_args()
+
+    worker = Worker()
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    worker.run(once=args.once)
+
+
+if __name__ == "__main__":
+    main()
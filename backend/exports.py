@@ -0,0 +1,244 @@
+import multiprocessing
+import tempfile
+import threading
+import zipfile
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Executor, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from types import SimpleNamespace
+from typing import AsyncIterator, Callable, Dict, List, Optional
+
+from fastapi.concurrency import run_in_threadpool
+
+from config import settings
+from CRUD import create_excel_modified
+from models import AdminModifiedPresence
+from pdf_converter import xlsx_to_pdf
+from pdf_renderer import NATIVE, render_modified_pdf
+
+
+PRESENCE_COLUMNS = [column.key for column in AdminModifiedPresence.__table__.columns]
+
+_render_executor = None
+_render_executor_lock = threading.Lock()
+
+
+def render_modified_workbook(employee: dict, presence_rows: List[dict]) -> bytes:
+    """create_excel_modified from plain values, so it can run in another process."""
+    presence_data = [AdminModifiedPresence(**row) for row in presence_rows]
+    return create_excel_modified(presence_data, SimpleNamespace(**employee)).getvalue()
+
+
+def render_modified_timesheet(employee: dict, presence_rows: List[dict]) -> bytes:
+    """render_modified_pdf from plain values, so it can run in another process."""
+    presence_data = [AdminModifiedPresence(**row) for row in presence_rows]
+    return render_modified_pdf(presence_data, SimpleNamespace(**employee))
+
+
+def render_executor() -> Executor:
+    """Processes shared by the exports; spawned rather than forked from the threaded server."""
+    global _render_executor
+    with _render_executor_lock:
+        if _render_executor is None:
+            if settings.EXPORT_RENDER_PROCESSES > 0:
+                _render_executor = ProcessPoolExecutor(max_workers=settings.EXPORT_RENDER_PROCESSES,
+                                                       mp_context=multiprocessing.get_context("spawn"))
+            else:
+                _render_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="export-render")
+        return _render_executor
+
+
+def shutdown_render_executor():
+    global _render_executor
+    with _render_executor_lock:
+        if _render_executor is not None:
+            _render_executor.shutdown(cancel_futures=True)
+            _render_executor = None
+
+
+def write_month_archive(zip_file: zipfile.ZipFile, employees, presences: Dict[int, list], year, month, pdf: bool,
+                        progress: Optional[Callable[[int, int], None]] = None, pdf_renderer: Optional[str] = None):
+    """Renders the workbooks on the render processes and the PDFs concurrently, writing each file
+    into zip_file as soon as it is ready. Raises the first failure (e.g. ConversionError).
+
+    PDFs are drawn on the render processes too with the native pdf_renderer (PDF_RENDERER by
+    default), or converted from the workbooks by LibreOffice. progress is called with
+    (completed, total) employees each time one is fully written.
+    """
+    pdf_renderer = pdf_renderer or settings.PDF_RENDERER
+    renderer = render_executor()
+    jobs = [(employee, presences[employee.id]) for employee in employees if presences.get(employee.id)]
+    # Bounds the rendered workbooks held in memory while they wait for a converter
+    window = 2 * (max(settings.EXPORT_RENDER_PROCESSES, 1) + settings.EXPORT_PDF_CONCURRENCY)
+    pending = {}
+    next_job = completed = 0
+
+    with ThreadPoolExecutor(max_workers=max(settings.EXPORT_PDF_CONCURRENCY, 1),
+                            thread_name_prefix="export-pdf") as converter:
+        try:
+            while next_job < len(jobs) or pending:
+                while next_job < len(jobs) and len(pending) < window:
+                    employee, presence_data = jobs[next_job]
+                    next_job += 1
+                    filename_base = f"presence_overview_{year}_{month}_{employee.name}_{employee.surname}"
+                    employee_values = {"name": employee.name, "surname": employee.surname}
+                    rows = [{column: getattr(row, column) for column in PRESENCE_COLUMNS} for row in presence_data]
+                    future = renderer.submit(render_modified_workbook, employee_values, rows)
+                    pending[future] = (f"{filename_base}.xlsx", filename_base, (employee_values, rows))
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    filename, filename_base, values = pending.pop(future)
+                    content = future.result()
+                    # An xlsx is a zip already, deflating it again only costs time
+                    zip_file.writestr(filename, content, zipfile.ZIP_STORED if filename.endswith(".xlsx")
+                                      else zipfile.ZIP_DEFLATED)
+                    if pdf and filename.endswith(".xlsx"):
+                        if pdf_renderer == NATIVE:
+                            future = renderer.submit(render_modified_timesheet, *values)
+                        else:
+                            future = converter.submit(xlsx_to_pdf, content)
+                        pending[future] = (f"{filename_base}.pdf", filename_base, None)
+                    else:
+                        completed += 1
+                        if progress is not None:
+                            progress(completed, len(jobs))
+        except BaseException:
+            for future in pending:
+                future.cancel()
+            raise
+
+
+class ArchiveStream:
+    """Pipe between the thread writing an archive and the response reading it.
+
+    Written data is kept in memory up to memory_limit bytes and spilled to a temporary file
+    beyond, so a slow client neither blocks the writer (and the converters it holds) nor grows
+    the memory. Not seekable, zipfile then writes the sizes after each member.
+    """
+
+    def __init__(self, memory_limit: int):
+        self.memory_limit = memory_limit
+        self._chunks = deque()
+        self._memory_bytes = 0
+        self._spill = None
+        self._spill_read = self._spill_written = 0
+        self._finished = self._abandoned = False
+        self._error = None
+        self._changed = threading.Condition()
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        with self._changed:
+            if self._abandoned:
+                raise BrokenPipeError("The client went away")
+            # Once spilling, everything goes to the file until the reader caught up, to keep the order
+            if self._spill_read < self._spill_written or self._memory_bytes + len(data) > self.memory_limit:
+                if self._spill is None:
+                    self._spill = tempfile.TemporaryFile(prefix="presenza-export-")
+                self._spill.seek(self._spill_written)
+                self._spill.write(data)
+                self._spill_written += len(data)
+            else:
+                self._chunks.append(data)
+                self._memory_bytes += len(data)
+            self._changed.notify_all()
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def finish(self, error: Exception = None):
+        with self._changed:
+            self._finished = True
+            self._error = error
+            self._changed.notify_all()
+            self._close_when_done()
+
+    def read(self, size: int) -> bytes:
+        """Up to size bytes, waiting for the writer; b"" at the end. Raises the writer's error."""
+        with self._changed:
+            while not (self._chunks or self._spill_read < self._spill_written or self._finished or self._abandoned):
+                self._changed.wait()
+            if self._chunks:
+                parts = []
+                while self._chunks and size > 0:
+                    chunk = self._chunks.popleft()
+                    if len(chunk) > size:
+                        self._chunks.appendleft(chunk[size:])
+                        chunk = chunk[:size]
+                    parts.append(chunk)
+                    size -= len(chunk)
+                    self._memory_bytes -= len(chunk)
+                return b"".join(parts)
+            if self._spill_read < self._spill_written:
+                self._spill.seek(self._spill_read)
+                data = self._spill.read(min(size, self._spill_written - self._spill_read))
+                self._spill_read += len(data)
+                if self._spill_read == self._spill_written:
+                    self._spill.truncate(0)
+                    self._spill_read = self._spill_written = 0
+                return data
+            if self._error is not None:
+                raise self._error
+            return b""
+
+    def abandon(self):
+        """The reader is done, whether it read everything or not."""
+        with self._changed:
+            self._abandoned = True
+            self._changed.notify_all()
+            self._close_when_done()
+
+    def _close_when_done(self):
+        # The writer may still be finishing after the reader left, and the other way round
+        if self._finished and self._abandoned and self._spill is not None:
+            self._spill.close()
+            self._spill = None
+
+
+def stream_month_archive(employees, presences: Dict[int, list], year, month, pdf: bool,
+                         pdf_renderer: Optional[str] = None) -> AsyncIterator[bytes]:
+    """Starts writing the month archive and waits for the files of its first employee, then returns
+    the archive as it is written, for a StreamingResponse. Blocks, call it from a worker thread.
+
+    A failure until then is raised here, before any response is sent. Past it the status and
+    headers are gone out, a failure can only cut the download short and is logged. When the
+    client goes away the writer stops at its next write."""
+    stream = ArchiveStream(settings.EXPORT_ARCHIVE_MEMORY_BYTES)
+    started = threading.Event()
+    failure = []
+
+    def write():
+        try:
+            with zipfile.ZipFile(stream, "w", zipfile.ZIP_DEFLATED) as zip_file:
+                write_month_archive(zip_file, employees, presences, year, month, pdf,
+                                    lambda completed, total: started.set(), pdf_renderer)
+        except BrokenPipeError:
+            stream.finish()
+        except Exception as e:
+            print(f"Failed to export the presence overviews of {year}-{month}: {e}")
+            failure.append(e)
+            stream.finish(e)
+        else:
+            stream.finish()
+        finally:
+            started.set()
+
+    writer = threading.Thread(target=write, name="export-archive", daemon=True)
+    writer.start()
+    started.wait()
+    if failure:
+        stream.abandon()
+        raise failure[0]
+    return archive_chunks(stream)
+
+
+async def archive_chunks(stream: ArchiveStream) -> AsyncIterator[bytes]:
+    try:
+        while True:
+            chunk = await run_in_threadpool(stream.read, settings.EXPORT_ARCHIVE_CHUNK_BYTES)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        stream.abandon()
@@ -0,0 +1,163 @@
+import queue
+import smtplib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from typing import List, Optional, Tuple
+
+from config import settings
+
+
+def build_message(sender: str, receiver_email: str, subject: str, body: str) -> MIMEMultipart:
+    msg = MIMEMultipart("alternative")
+    msg.attach(MIMEText(body, "html"))
+    msg["Subject"] = subject
+    msg["From"] = sender
+    msg["To"] = receiver_email
+    return msg
+
+
+class PooledConnection:
+    def __init__(self, server: smtplib.SMTP):
+        self.server = server
+        self.sent = 0
+        self.last_used = time.monotonic()
+
+    def close(self):
+        try:
+            self.server.quit()
+        except (smtplib.SMTPException, OSError):
+            self.server.close()
+
+
+class SMTPConnectionPool:
+    """Authenticated SMTP connections reused across messages, at most size of them at once."""
+
+    def __init__(self, host: str, port: int, use_ssl: bool, username: str, password: str, size: int,
+                 timeout: float, idle_seconds: float, max_messages: int):
+        self.host = host
+        self.port = port
+        self.use_ssl = use_ssl
+        self.username = username
+        self.password = password
+        self.size = size
+        self.timeout = timeout
+        self.idle_seconds = idle_seconds
+        self.max_messages = max_messages
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _connect(self) -> PooledConnection:
+        if self.use_ssl:
+            server = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+        else:
+            server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.username:
+            server.login(self.username, self.password)
+        return PooledConnection(server)
+
+    def _take(self) -> PooledConnection:
+        while True:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+            # Servers drop idle sessions, a stale one would only cost a retry
+            if time.monotonic() - connection.last_used < self.idle_seconds:
+                return connection
+            connection.close()
+
+    def _release(self, connection: PooledConnection):
+        connection.last_used = time.monotonic()
+        if connection.sent >= self.max_messages:
+            connection.close()
+        else:
+            self._idle.put(connection)
+
+    @contextmanager
+    def connection(self):
+        with self._slots:
+            connection = self._take()
+            try:
+                yield connection.server
+            except (smtplib.SMTPRecipientsRefused, smtplib.SMTPResponseException) as e:
+                # The server answered and the session is still usable, unless it is closing it (421)
+                if getattr(e, "smtp_code", None) == 421:
+                    connection.close()
+                else:
+                    self._release(connection)
+                raise
+            except BaseException:
+                connection.close()
+                raise
+            connection.sent += 1
+            self._release(connection)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def is_transient(error: Exception) -> bool:
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    if isinstance(error, smtplib.SMTPNotSupportedError):
+        return False
+    # Disconnects, timeouts and refused connections (SMTPException is an OSError too)
+    return isinstance(error, OSError)
+
+
+class MailDispatcher:
+    """Sends html mails over the pool, up to pool size in parallel, retrying transient failures."""
+
+    def __init__(self, pool: SMTPConnectionPool, sender: str, max_retries: int, retry_backoff: float):
+        self.pool = pool
+        self.sender = sender
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+
+    def deliver(self, receiver_email: str, subject: str, body: str):
+        """Sends one mail, raising the last error when it is permanent or retries ran out."""
+        message = build_message(self.sender, receiver_email, subject, body).as_string()
+        for attempt in range(self.max_retries + 1):
+            try:
+                with self.pool.connection() as server:
+                    server.sendmail(self.sender, receiver_email, message)
+                return
+            except Exception as e:
+                if attempt == self.max_retries or not is_transient(e):
+                    raise
+                time.sleep(self.retry_backoff * 2 ** attempt)
+
+    def deliver_many(self, messages: List[Tuple[str, str, str]]) -> List[Optional[Exception]]:
+        """The error of each (receiver, subject, body), None when sent; one worker per pooled connection."""
+        def deliver(message):
+            try:
+                self.deliver(*message)
+            except Exception as e:
+                return e
+            return None
+
+        with ThreadPoolExecutor(max_workers=self.pool.size, thread_name_prefix="mail") as executor:
+            return list(executor.map(deliver, messages))
+
+    def close(self):
+        self.pool.close()
+
+
+def create_mail_dispatcher() -> MailDispatcher:
+    pool = SMTPConnectionPool(settings.SMTP_HOST, settings.SMTP_PORT, settings.SMTP_SSL, settings.SMTP_USERNAME,
+                              settings.SMTP_PASSWORD, settings.SMTP_POOL_SIZE, settings.SMTP_TIMEOUT_SECONDS,
+                              settings.SMTP_IDLE_SECONDS, settings.SMTP_MAX_MESSAGES_PER_CONNECTION)
+    return MailDispatcher(pool, settings.SMTP_USERNAME, settings.SMTP_MAX_RETRIES, settings.SMTP_RETRY_BACKOFF_SECONDS)
+
+
+mail_dispatcher = create_mail_dispatcher()
@@ -0,0 +1,79 @@
+"""Delivers the email outbox, next to the API and as many times as needed.
+
+    python mail_worker.py           # keeps polling the outbox
+    python mail_worker.py --once    # stops once nothing is claimable
+"""
+import argparse
+import signal
+import time
+
+from config import settings
+from database import SessionLocal
+from mail import mail_dispatcher
+from outbox import claim_batch, outbox_status, purge_sent, record_results
+
+
+PURGE_INTERVAL_SECONDS = 3600
+
+
+class Worker:
+    def __init__(self):
+        self.stopping = False
+        self.started = time.monotonic()
+        self.sent = self.retried = self.failed = 0
+
+    def stop(self, *args):
+        # The batch in progress is finished and recorded first
+        self.stopping = True
+
+    def run_batch(self, db) -> int:
+        rows = claim_batch(db, settings.OUTBOX_BATCH_SIZE, settings.OUTBOX_LEASE_SECONDS)
+        if not rows:
+            return 0
+        errors = mail_dispatcher.deliver_many([(row.receiver_email, row.subject, row.body) for row in rows])
+        sent, retried, failed = record_results(db, rows, errors, settings.OUTBOX_MAX_ATTEMPTS,
+                                               settings.OUTBOX_RETRY_BACKOFF_SECONDS)
+        self.sent += sent
+        self.retried += retried
+        self.failed += failed
+        for row, error in zip(rows, errors):
+            if error is not None:
+                print(f"Failed to send email {row.id} to {row.receiver_email} (attempt {row.attempts}): {error}")
+
+        status = outbox_status(db)
+        elapsed = time.monotonic() - self.started
+        print(f"Batch of {len(rows)}: sent {sent}, retrying {retried}, failed {failed} | "
+              f"since start: sent {self.sent} ({self.sent / elapsed:.1f}/s), retried {self.retried}, failed {self.failed} | "
+              f"backlog {status['pending'] + status['sending']}, oldest {status['oldest_queued_seconds']:.0f} s")
+        return len(rows)
+
+    def run(self, once: bool = False):
+        last_purge = 0.0
+        try:
+            while not self.stopping:
+                with SessionLocal() as db:
+                    if time.monotonic() - last_purge > PURGE_INTERVAL_SECONDS:
+                        purge_sent(db, settings.OUTBOX_RETENTION_DAYS)
+                        last_purge = time.monotonic()
+                    claimed = self.run_batch(db)
+                if not claimed:
+                    if once:
+                        break
+                    time.sleep(settings.OUTBOX_POLL_SECONDS)
+        finally:
+            mail_dispatcher.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Deliver the queued emails")
+    parser.add_argument("--once", action="store_true", help="exit once nothing is claimable")
+    args = parser.parse_args()
+
+    worker = Worker()
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    worker.run(once=args.once)
+
+
+if __name__ == "__main__":
+    main()
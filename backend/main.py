@@ -1,39 +1,51 @@
-import copy
 import os
-import subprocess
-from io import BytesIO
-import tempfile
-from fastapi import Body, FastAPI, Query, Path, BackgroundTasks, Response, Form
+from fastapi import Body, FastAPI, Query, Path, Response, Form
 from pydantic import EmailStr
 from fastapi.exceptions import RequestValidationError
 from fastapi.exception_handlers import request_validation_exception_handler
 
-from auth import get_password_hash, authenticate_user, \
-    create_access_token, delete_user_from_db, get_current_user, update_user_db, get_all_users, get_all_employees, generate_otp, send_otp_email
-from config import ACCESS_TOKEN_EXPIRE_MINUTES
+from auth import get_password_hash_async, authenticate_user, \
+    create_access_token, delete_user_from_db, get_current_user, update_user_db, get_all_users, get_all_employees, generate_otp, send_otp_email, \
+    get_all_employees_async, principal_cache, token_versions, token_claims, bump_token_version, \
+    create_refresh_session, rotate_refresh_session, revoke_refresh_session
+from config import ACCESS_TOKEN_EXPIRE_MINUTES, settings
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi import Depends, HTTPException, status, Request
-from fastapi.responses import FileResponse 
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from passlib.context import CryptContext
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from database import get_db
-from models import User, NationalHolidays, AdminModifiedPresence
-from datetime import datetime, timedelta, time
-from typing import List
-import zipfile
+from database import get_db, get_read_db, get_async_db, read_session_factory, engine, read_engine, async_engine, pool_status
+from models import User, NationalHolidays, AdminModifiedPresence, ExportJob
+from partitions import ensure_presence_partitions
+from otp_store import create_otp_store
+from outbox import enqueue_emails, outbox_status
+from pdf_converter import ConversionError, pdf_converter_pool, xlsx_to_pdf
+from payroll_export import PAYROLL_MEDIA_TYPES, PAYROLL_WRITERS, parquet_supported, stream_payroll
+from pdf_renderer import LIBREOFFICE, NATIVE, PDF_RENDERERS, render_modified_pdf
+from exports import shutdown_render_executor, stream_month_archive
+from export_cache import etag, etag_matches, export_cache
+from export_jobs import DONE, enqueue_export_job
+from datetime import datetime, timedelta
+from typing import List, Optional
 from models import DailyPresence
 from serialization import EmailRequestAll, UserCreate, Token, UserPresence, UserUpdate, DailyPresenceBase, HoursDefaultBase, UserBase, UserBaseID, \
-    EmailRequest, EmailRequestPerUser, ModifiedDailyPresenceBase, PasswordChangeRequest, EmailOTPRequest, OTPVerifyRequest
-from CRUD import get_daily_presences, get_user_default_hours, create_default_hours, get_user_by_id, get_hour_minute, has_admin_submitted_presence, \
-    has_submitted_presence, send_email_to_employee, calculate_hours_per_day, create_excel_original, create_excel_modified
+    EmailRequest, EmailRequestPerUser, ModifiedDailyPresenceBase, PasswordChangeRequest, EmailOTPRequest, OTPVerifyRequest, \
+    RefreshTokenRequest, ExportJobRequest, ExportJobStatus
+from CRUD import get_daily_presences, get_user_default_hours, create_default_hours, get_user_by_id_async, \
+    get_user_by_username_async, \
+    get_month_submission_status, create_excel_original, create_excel_modified, \
+    bulk_upsert_monthly_presence, get_month_presences, bulk_update_admin_presence, modified_to_daily_presence, \
+    get_month_summary, format_month_overview, get_company_month_presences, get_month_revision
 
 
 app = FastAPI(root_path="/api")
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
-otp_storage = {} #Consider using database if needed
+otp_store = create_otp_store()
 
 origins = [
     "http://localhost:3000",  # React frontend
@@ -49,24 +61,61 @@ app.add_middleware(
 )
 
 
+@app.on_event("startup")
+def create_presence_partitions():
+    # Keeps the yearly partitions of the presence tables ahead of the calendar
+    try:
+        with engine.begin() as connection:
+            ensure_presence_partitions(connection)
+    except Exception as e:
+        print(f"Could not create the presence partitions: {e}")
+
+
+@app.on_event("startup")
+async def start_otp_sweeper():
+    otp_store.start()
+
+
+@app.on_event("shutdown")
+async def stop_otp_sweeper():
+    await otp_store.stop()
+
+
+@app.on_event("startup")
+def start_pdf_converters():
+    # Otherwise LibreOffice only starts for the requests asking for it
+    if settings.PDF_CONVERTERS > 0 and settings.PDF_RENDERER == LIBREOFFICE:
+        pdf_converter_pool.warm_up()
+
+
+@app.on_event("shutdown")
+def stop_pdf_converters():
+    pdf_converter_pool.close()
+
+
+@app.on_event("shutdown")
+def stop_export_renderers():
+    shutdown_render_executor()
+
+
 @app.post("/register", response_model=UserCreate)
-async def register(user: UserCreate, db: Session = Depends(get_db)):
-    db_user = db.query(User).filter(User.work_email == user.work_email).first()
+async def register(user: UserCreate, db: AsyncSession = Depends(get_async_db)):
+    db_user = await get_user_by_username_async(db, user.work_email)
     if db_user:
         raise HTTPException(status_code=400, detail="A user with this email is already registered in the system")
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await get_password_hash_async(user.password)
     new_user = User(name=str.capitalize(user.name), surname=str.capitalize(user.surname), job_start_date=user.job_start_date,
                     full_time=user.full_time, phone_number=str(user.phone_number), personal_email=str.lower(user.personal_email),
                     work_email=str.lower(user.work_email), password=hashed_password, role=user.role, iban=str.upper(user.iban))
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
+    principal_cache.invalidate(new_user.work_email)
     return new_user
 
 
 @app.post("/token", response_model=Token)
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = authenticate_user(db, form_data.username, form_data.password)
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -79,11 +128,36 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
             detail="User is disabled",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    refresh_token = await create_refresh_session(db, user)
+    return token_response(user, refresh_token)
+
+
+def token_response(user: User, refresh_token: str):
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user.work_email}, expires_delta=access_token_expires
+        data=token_claims(user), expires_delta=access_token_expires
     )
-    return {"access_token": access_token, "token_type": "bearer", "role": user.role, "user_id": user.id}
+    return {"access_token": access_token, "token_type": "bearer", "role": user.role, "user_id": user.id,
+            "refresh_token": refresh_token}
+
+
+@app.post("/token/refresh", response_model=Token)
+async def refresh_access_token(request: RefreshTokenRequest, db: AsyncSession = Depends(get_async_db)):
+    # Renews the access token without the password; the refresh token is rotated on every use
+    user, refresh_token = await rotate_refresh_session(db, request.refresh_token)
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or expired refresh token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return token_response(user, refresh_token)
+
+
+@app.post("/token/revoke")
+async def revoke_refresh_token(request: RefreshTokenRequest, db: AsyncSession = Depends(get_async_db)):
+    await revoke_refresh_session(db, request.refresh_token)
+    return {"message": "Session closed"}
 
 
 @app.delete("/users/delete/{user_id}")
@@ -95,36 +169,39 @@ def delete_user(user_id: int, db: Session = Depends(get_db), current_user: User
 
 
 @app.put("/users/update/{user_id}", response_model=UserUpdate)
-async def update_user(background_tasks: BackgroundTasks, user: UserUpdate, db: Session = Depends(get_db)):
-    updated_user = update_user_db(db=db, user=user, background_tasks=background_tasks)
+async def update_user(user: UserUpdate, db: AsyncSession = Depends(get_async_db)):
+    updated_user = await update_user_db(db=db, user=user)
     if not updated_user:
         raise HTTPException(status_code=404, detail="User not found")
     return updated_user
 
 
 @app.put("/users/change-password")
-async def change_password(request: PasswordChangeRequest, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.work_email == request.work_email).first()
+async def change_password(request: PasswordChangeRequest, db: AsyncSession = Depends(get_async_db)):
+    user = await get_user_by_username_async(db, request.work_email)
     if not user:
         raise HTTPException(status_code=200, detail="User with this email does not exist")
 
-    user.password = get_password_hash(request.new_password)
-    db.commit()
+    user.password = await get_password_hash_async(request.new_password)
+    bump_token_version(user)
+    await db.commit()
+    principal_cache.invalidate(user.work_email)
+    token_versions.invalidate(user.id)
     return {"message": "Password updated successfully"}
 
 
 @app.get("/users", response_model=List[UserBaseID])
-async def fetch_employees(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    db_users = get_all_employees(db=db)
+async def fetch_employees(db: AsyncSession = Depends(get_async_db), current_user: User = Depends(get_current_user)):
+    db_users = await get_all_employees_async(db=db)
     return db_users
 
 
 @app.get("/users/{employeeId}", response_model=UserBase)
-async def fetch_user(db: Session = Depends(get_db),
+async def fetch_user(db: AsyncSession = Depends(get_async_db),
                      current_user: User = Depends(get_current_user),
                      employeeId: int = Path(..., description="ID of the employee to retrieve")):
 
-    return get_user_by_id(db=db, user_id=employeeId)
+    return await get_user_by_id_async(db=db, user_id=employeeId)
 
 
 # Get Daily Presence records for a user in a specific month
@@ -167,119 +244,10 @@ def create_update_monthly_presence(
         user_id: int = Query(..., description="User ID required"),
         db: Session = Depends(get_db)):
 
-    response_data = []
     if not presence_data:
         raise HTTPException(status_code=422, detail="No records found for this month")
 
-    for day_data in presence_data:
-        existing_record = (
-            db.query(DailyPresence)
-            .filter(DailyPresence.employee_id == user_id, DailyPresence.date == day_data.date)
-            .first()
-        )
-
-        admin_existing_record = (
-            db.query(AdminModifiedPresence)
-            .filter(AdminModifiedPresence.employee_id == user_id, AdminModifiedPresence.date == day_data.date)
-            .first()
-        )
-
-        if day_data.day_off or day_data.national_holiday or day_data.weekend:
-            day_data.entry_time_morning = time(0, 0)
-            day_data.exit_time_morning = time(0, 0)
-            day_data.entry_time_afternoon = time(0, 0)
-            day_data.exit_time_afternoon = time(0, 0)
-
-        if existing_record:
-            existing_record.entry_time_morning = day_data.entry_time_morning
-            existing_record.exit_time_morning = day_data.exit_time_morning
-            existing_record.entry_time_afternoon = day_data.entry_time_afternoon
-            existing_record.exit_time_afternoon = day_data.exit_time_afternoon
-            existing_record.national_holiday = day_data.national_holiday
-            existing_record.weekend = day_data.weekend
-            existing_record.day_off = day_data.day_off
-            existing_record.time_off = day_data.time_off
-            existing_record.extra_hours = day_data.extra_hours
-            existing_record.illness = day_data.illness
-            existing_record.notes = day_data.notes
-
-            if admin_existing_record:
-                admin_existing_record.modified_entry_time_morning = day_data.entry_time_morning
-                admin_existing_record.modified_exit_time_morning = day_data.exit_time_morning
-                admin_existing_record.modified_entry_time_afternoon = day_data.entry_time_afternoon
-                admin_existing_record.modified_exit_time_afternoon = day_data.exit_time_afternoon
-                admin_existing_record.modified_national_holiday = day_data.national_holiday
-                admin_existing_record.modified_weekend = day_data.weekend
-                admin_existing_record.modified_day_off = day_data.day_off
-                admin_existing_record.modified_time_off = day_data.time_off
-                admin_existing_record.modified_extra_hours = day_data.extra_hours
-                admin_existing_record.modified_illness = day_data.illness
-                admin_existing_record.modified_notes = day_data.notes
-            else:
-                new_admin_record = AdminModifiedPresence(
-                    employee_id=user_id,
-                    original_presence_id=existing_record.id,
-                    date=day_data.date,
-                    modified_entry_time_morning=day_data.entry_time_morning,
-                    modified_exit_time_morning=day_data.exit_time_morning,
-                    modified_entry_time_afternoon=day_data.entry_time_afternoon,
-                    modified_exit_time_afternoon=day_data.exit_time_afternoon,
-                    modified_national_holiday=day_data.national_holiday,
-                    modified_weekend=day_data.weekend,
-                    modified_day_off=day_data.day_off,
-                    modified_time_off=day_data.time_off,
-                    modified_extra_hours=day_data.extra_hours,
-                    modified_illness=day_data.illness,
-                    modified_notes=day_data.notes,
-                )
-                db.add(new_admin_record)
-            response_data.append(existing_record)
-        else:
-            new_employee_record = DailyPresence(
-                employee_id=user_id,
-                date=day_data.date,
-                entry_time_morning=day_data.entry_time_morning,
-                exit_time_morning=day_data.exit_time_morning,
-                entry_time_afternoon=day_data.entry_time_afternoon,
-                exit_time_afternoon=day_data.exit_time_afternoon,
-                national_holiday=day_data.national_holiday,
-                weekend=day_data.weekend,
-                day_off=day_data.day_off,
-                time_off=day_data.time_off,
-                extra_hours=day_data.extra_hours,
-                illness=day_data.illness,
-                notes=day_data.notes,
-            )
-            db.add(new_employee_record)
-            db.commit()
-            db.refresh(new_employee_record)
-
-            new_admin_record = AdminModifiedPresence(
-                employee_id=user_id,
-                original_presence_id=new_employee_record.id,
-                date=day_data.date,
-                modified_entry_time_morning=day_data.entry_time_morning,
-                modified_exit_time_morning=day_data.exit_time_morning,
-                modified_entry_time_afternoon=day_data.entry_time_afternoon,
-                modified_exit_time_afternoon=day_data.exit_time_afternoon,
-                modified_national_holiday=day_data.national_holiday,
-                modified_weekend=day_data.weekend,
-                modified_day_off=day_data.day_off,
-                modified_time_off=day_data.time_off,
-                modified_extra_hours=day_data.extra_hours,
-                modified_illness=day_data.illness,
-                modified_notes=day_data.notes,
-            )
-            db.add(new_admin_record)
-            db.commit()
-            response_data.append(new_employee_record)
-
-    db.commit()
-
-    for record in response_data:
-        db.refresh(record)
-
-    return response_data
+    return bulk_upsert_monthly_presence(db, user_id, presence_data)
 
 
 @app.post("/submit-admin-presence", response_model=List[DailyPresenceBase])
@@ -288,136 +256,31 @@ def update_monthly_presence(
         user_id: int = Query(..., description="User ID required"),
         db: Session = Depends(get_db)):
 
-    updated_records = []
     if not presence_data:
         raise HTTPException(status_code=422, detail="No records found for this month")
 
-    for day_data in presence_data:
-        admin_existing_record = (
-            db.query(AdminModifiedPresence)
-            .filter(AdminModifiedPresence.employee_id == user_id, AdminModifiedPresence.date == day_data.date)
-            .first()
-        )
-
-        if day_data.day_off or day_data.national_holiday or day_data.weekend:
-            day_data.entry_time_morning = time(0, 0)
-            day_data.exit_time_morning = time(0, 0)
-            day_data.entry_time_afternoon = time(0, 0)
-            day_data.exit_time_afternoon = time(0, 0)
-
-        if admin_existing_record:
-            admin_existing_record.modified_entry_time_morning = day_data.entry_time_morning
-            admin_existing_record.modified_exit_time_morning = day_data.exit_time_morning
-            admin_existing_record.modified_entry_time_afternoon = day_data.entry_time_afternoon
-            admin_existing_record.modified_exit_time_afternoon = day_data.exit_time_afternoon
-            admin_existing_record.modified_national_holiday = day_data.national_holiday
-            admin_existing_record.modified_weekend = day_data.weekend
-            admin_existing_record.modified_day_off = day_data.day_off
-            admin_existing_record.modified_time_off = day_data.time_off
-            admin_existing_record.modified_illness = day_data.illness
-            admin_existing_record.modified_notes = day_data.notes
-        updated_records.append(admin_existing_record)
-        
-        if not admin_existing_record :
-            raise HTTPException(status_code=200, detail="Data is not present in the system for current month")
-
-    db.commit()
-    for record in updated_records:
-        db.refresh(record)
-
-    response_data = [
-    DailyPresenceBase(
-        employee_id=record.employee_id,
-        date=record.date,
-        entry_time_morning=record.modified_entry_time_morning,
-        exit_time_morning=record.modified_exit_time_morning,
-        entry_time_afternoon=record.modified_entry_time_afternoon,
-        exit_time_afternoon=record.modified_exit_time_afternoon,
-        national_holiday=record.modified_national_holiday,
-        weekend=record.modified_weekend,
-        day_off=record.modified_day_off,
-        time_off=record.modified_time_off,
-        extra_hours=record.modified_extra_hours,
-        illness=record.modified_illness,
-        notes=record.modified_notes
-    )
-    for record in updated_records]    
+    response_data = bulk_update_admin_presence(db, user_id, presence_data)
+    if response_data is None:
+        raise HTTPException(status_code=200, detail="Data is not present in the system for current month")
 
     return response_data
 
 
 @app.get("/employee-presence/{user_id}/{year}/{month}", response_model=List[DailyPresenceBase])
-def get_daily_presence(user_id: int, month: str, year: str, db: Session = Depends(get_db)):
+def get_daily_presence(user_id: int, month: str, year: str, db: Session = Depends(get_read_db)):
     try:
-        # Parse the month string to a datetime object
-        month_start = datetime.strptime(year+month, "%Y%m")
-        if month_start.month == 12:
-            month_end = datetime(month_start.year, month_start.month, 31)
-            presence_data = (
-            db.query(DailyPresence)
-            .filter(
-                DailyPresence.employee_id == user_id,
-                DailyPresence.date >= month_start,
-                DailyPresence.date <= month_end
-            )
-            .all())
-        else:    
-            month_end = datetime(month_start.year, month_start.month + 1, 1)
-
-            presence_data = (
-            db.query(DailyPresence)
-            .filter(
-                DailyPresence.employee_id == user_id,
-                DailyPresence.date >= month_start,
-                DailyPresence.date < month_end
-            )
-            .all())
+        presence_data = get_month_presences(db, DailyPresence, user_id, year, month)
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid month format. Use 'YYYY-MM'.")
 
-
-
     return presence_data
 
 
 @app.get("/admin-modified-presence/{user_id}/{year}/{month}", response_model=List[DailyPresenceBase])
-def get_admin_modified_presence(user_id: int, month: str, year: str, db: Session = Depends(get_db)):
+def get_admin_modified_presence(user_id: int, month: str, year: str, db: Session = Depends(get_read_db)):
     try:
-        month_start = datetime.strptime(year+month, "%Y%m")
-        if month_start.month == 12:
-            month_end = datetime(month_start.year, month_start.month, 31)
-        else:    
-            month_end = datetime(month_start.year, month_start.month + 1, 1)    
-            
-
-        db_records = (
-        db.query(AdminModifiedPresence)
-        .filter(
-            AdminModifiedPresence.employee_id == user_id,
-            AdminModifiedPresence.date >= month_start,
-            AdminModifiedPresence.date < month_end
-        )
-        .all()
-        )
-        response_data = []
-        for record in db_records:
-            daily_presence = DailyPresenceBase(
-                employee_id=record.employee_id,
-                date=record.date,
-                entry_time_morning=record.modified_entry_time_morning,
-                exit_time_morning=record.modified_exit_time_morning,
-                entry_time_afternoon=record.modified_entry_time_afternoon,
-                exit_time_afternoon=record.modified_exit_time_afternoon,
-                national_holiday=record.modified_national_holiday,
-                weekend=record.modified_weekend,
-                day_off=record.modified_day_off,
-                time_off=record.modified_time_off,
-                extra_hours=record.modified_extra_hours,
-                illness=record.modified_illness,
-                notes=record.modified_notes
-            )
-            response_data.append(daily_presence)
-
+        db_records = get_month_presences(db, AdminModifiedPresence, user_id, year, month)
+        response_data = [modified_to_daily_presence(record) for record in db_records]
     except ValueError:
         raise HTTPException(status_code=200, detail="Invalid month format. Use 'YYYY-MM'.")
 
@@ -427,101 +290,19 @@ def get_admin_modified_presence(user_id: int, month: str, year: str, db: Session
 @app.get("/employee-total_presence/{user_id}/{year}/{month}", response_model=dict)
 def get_employee_overview(user_id: int, month: str, year: str, db: Session = Depends(get_db)):
     try:
-        # Parse the month string to a datetime object
-        month_start = datetime.strptime(year+month, "%Y%m")
-        if month_start.month == 12:
-            month_end = datetime(month_start.year, month_start.month, 31)
-            presence_data = (
-            db.query(DailyPresence)
-            .filter(
-                DailyPresence.employee_id == user_id,
-                DailyPresence.date >= month_start,
-                DailyPresence.date <= month_end
-            )
-            .order_by(DailyPresence.date).all())
-        else:    
-            month_end = datetime(month_start.year, month_start.month + 1, 1)
-
-            presence_data = (
-            db.query(DailyPresence)
-            .filter(
-                DailyPresence.employee_id == user_id,
-                DailyPresence.date >= month_start,
-                DailyPresence.date < month_end
-            )
-            .order_by(DailyPresence.date).all())
+        summary = get_month_summary(db, user_id, year, month)
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid month format. Use 'YYYY-MM'.")
 
-
-    rawOverviewOfMonth = {'isSubmitted': False,
-                          'notes': '',
-                          'totalWorkedHoursInMonth': 0,
-                          'totalExtraHoursInMonth': 0,
-                          'totalOffHoursInMonth': 0,
-                          'totalOffDaysInMonth': 0,
-                          'totalExpectedWorkingHours': 0}
-
-    extraHoursInDays = ''
-    offHoursInDays = ''
-    daysOffInDays = ''
-
-    if presence_data:
-        rawOverviewOfMonth['isSubmitted'] = True
-
-        for day in presence_data:
-            if not (day.national_holiday or day.weekend):
-                rawOverviewOfMonth['totalExpectedWorkingHours'] += 8
-                if not day.day_off:
-                    workedHoursPerDay = calculate_hours_per_day(day.entry_time_morning,
-                                                                day.exit_time_morning,
-                                                                day.entry_time_afternoon,
-                                                                day.exit_time_afternoon)
-                    rawOverviewOfMonth['totalWorkedHoursInMonth'] += workedHoursPerDay
-                else:
-                    rawOverviewOfMonth['totalOffDaysInMonth'] += 1
-                    daysOffInDays += f'{day.date.day}\n'
-            if day.notes:
-                rawOverviewOfMonth['notes'] += f'day={day.date.day} : {day.notes}\n'
-
-            if day.extra_hours != time(0, 0):
-                rawOverviewOfMonth['totalExtraHoursInMonth'] += (datetime.combine(datetime.today(), day.extra_hours)
-                                                                 - datetime.combine(datetime.today(),
-                                                                                    time(0, 0))).seconds / 3600
-                extraHoursInDays += f'{day.date.day}\n'
-            if day.time_off != time(0, 0):
-                rawOverviewOfMonth['totalOffHoursInMonth'] += (datetime.combine(datetime.today(), day.time_off)
-                                                               - datetime.combine(datetime.today(),
-                                                                                  time(0, 0))).seconds / 3600
-                offHoursInDays += f'{day.date.day}\n'
-
-    overviewOfMonth = copy.deepcopy(rawOverviewOfMonth)
-    totalWorkedHours, totalWorkedRemainedMinutes = get_hour_minute(rawOverviewOfMonth['totalWorkedHoursInMonth'])
-    overviewOfMonth['totalWorkedHoursInMonth'] = f'{totalWorkedHours}:{totalWorkedRemainedMinutes}'
-
-    extraHoursHour, extraHoursMinute = get_hour_minute(rawOverviewOfMonth['totalExtraHoursInMonth'])
-    overviewOfMonth['totalExtraHoursInMonth'] = f'{extraHoursHour}:{extraHoursMinute} in days: {extraHoursInDays}'
-
-    offHoursHour, offHoursMinute = get_hour_minute(rawOverviewOfMonth['totalOffHoursInMonth'])
-    overviewOfMonth['totalOffHoursInMonth'] = f'{offHoursHour}:{offHoursMinute} in days: {offHoursInDays} '
-
-    totalOffDaysInMonth = rawOverviewOfMonth['totalOffDaysInMonth']
-    overviewOfMonth['totalOffDaysInMonth'] = f' {totalOffDaysInMonth} in days: {daysOffInDays}'
-
-    return overviewOfMonth
+    return format_month_overview(summary)
 
 
 @app.get("/retrieve_not_submitted_presence/{year}/{month}", response_model=List[UserBase])
 def retrieve_not_submitted_presence(month: str,
                                     year: str,
-                                    db: Session = Depends(get_db)):
+                                    db: Session = Depends(get_read_db)):
 
-    allEmployees = get_all_employees(db)
-
-    missing_employees = []
-    for employee in allEmployees:
-        if not has_submitted_presence(employee.id, year=year, month=month, db=db):
-            missing_employees.append(employee)
+    _, missing_employees = get_month_submission_status(db, year, month)
 
     return missing_employees
 
@@ -529,71 +310,54 @@ def retrieve_not_submitted_presence(month: str,
 @app.get("/retrieve_submitted_presence/{year}/{month}", response_model=List[UserPresence])
 def retrieve_submitted_presence(month: str,
                                 year: str,
-                                db: Session = Depends(get_db)):
-
-    allEmployees = get_all_employees(db)
+                                db: Session = Depends(get_read_db)):
 
-    submitted_employees = []
-    for employee in allEmployees:
-        if has_submitted_presence(employee.id, year=year, month=month, db=db):
-            submitted_employees.append(employee)
+    submitted_employees, _ = get_month_submission_status(db, year, month)
     return submitted_employees
 
 
 @app.post("/send_email_to_missing", response_model=List[UserBase])
 def send_email_to_missing(request: EmailRequest,
-               background_tasks: BackgroundTasks,
                db: Session = Depends(get_db)):
     year, month = request.yearMonth.split("-")
 
-    allEmployees = get_all_employees(db)
-
-    missing_employees = []
-    for employee in allEmployees:
-        if not has_submitted_presence(employee.id, year=year, month=month, db=db):
-            missing_employees.append(employee)
-    for employee in missing_employees:
-        background_tasks.add_task(
-            send_email_to_employee,
-            receiver_email=employee.work_email,
-            subject= request.textSubject,
-            body=request.textBody)
+    _, missing_employees = get_month_submission_status(db, year, month)
+    enqueue_emails(db, [employee.work_email for employee in missing_employees],
+                   subject=request.textSubject, body=request.textBody)
+    db.commit()
 
     return missing_employees
 
 
 @app.post("/send_email_to_all", response_model=List[UserBase])
 def send_email_to_all(request: EmailRequestAll,
-                          background_tasks: BackgroundTasks,
                           db: Session = Depends(get_db)):
 
     allEmployees = get_all_employees(db)
 
-    for employee in allEmployees:
-        background_tasks.add_task(
-            send_email_to_employee,
-            receiver_email=employee.work_email,
-            subject=request.textSubject,
-            body=request.textBody)
+    enqueue_emails(db, [employee.work_email for employee in allEmployees],
+                   subject=request.textSubject, body=request.textBody)
+    db.commit()
 
     return allEmployees
 
 
 @app.post("/send_email_to_employee", response_model=UserBase)
 def send_email_to_one(request: EmailRequestPerUser,
-                      background_tasks: BackgroundTasks,
                       db: Session = Depends(get_db)):
     userID = request.user_id
     employee = db.query(User).filter(User.id == userID).first()
-    background_tasks.add_task(
-        send_email_to_employee,
-        receiver_email=employee.work_email,
-        subject=request.textSubject,
-        body=request.textBody)
+    enqueue_emails(db, [employee.work_email], subject=request.textSubject, body=request.textBody)
+    db.commit()
 
     return employee
 
 
+@app.get("/email-outbox/status")
+def get_email_outbox_status(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    return outbox_status(db)
+
+
 @app.get("/get_national_holidays/{year}", response_model=List)
 def get_national_holidays(year: int, db: Session = Depends(get_db)):
     year_start = datetime(year, 1,1)
@@ -635,150 +399,153 @@ def remove_national_holiday(nationalHolidayDate: str, db: Session = Depends(get_
         raise HTTPException(status_code=404, detail="Date is not present in the system")
 
 
-@app.get("/export_original_presence_overview/{user_id}/{year}/{month}")
-def export_presence_overview(user_id: int, year: str, month: str, db: Session = Depends(get_db)):
-    overview = get_employee_overview(user_id, month, year, db)
-
-    if month == '12':
-            presence_data = (
-        db.query(DailyPresence)
-        .filter(DailyPresence.employee_id == user_id,
-                DailyPresence.date >= datetime.strptime(year + month, "%Y%m"),
-                DailyPresence.date <= datetime(int(year),int(month), 31))
-        .order_by(DailyPresence.date).all())
-    else:
-        presence_data = (
-            db.query(DailyPresence)
-            .filter(DailyPresence.employee_id == user_id,
-                    DailyPresence.date >= datetime.strptime(year + month, "%Y%m"),
-                    DailyPresence.date < datetime(int(year),int(month) + 1, 1))
-            .order_by(DailyPresence.date).all())
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+def export_response(request: Request, key: Optional[str], render, media_type: str, filename: str) -> Response:
+    """A per-employee export from the export cache, rendered on a miss; revalidated with its ETag."""
+    headers = {'Content-Disposition': f'attachment; filename="{filename}"'}
+    if key is not None:
+        headers.update({"ETag": etag(key), "Cache-Control": "private, no-cache"})
+        if etag_matches(request.headers.get("if-none-match"), key):
+            return Response(status_code=304, headers=headers)
+    return Response(content=export_cache.get_or_render(key, render), media_type=media_type, headers=headers)
+
+
+def export_month_revision(db: Session, user_id: int, year: str, month: str):
+    # Read before the presences: a write in between then only makes the cached copy newer than its key
+    try:
+        revision = get_month_revision(db, user_id, year, month)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid month format. Use 'YYYY-MM'.")
     employee = db.query(User).filter(User.id == user_id).first()
-    if presence_data:
-        excel_output = create_excel_original(presence_data, overview)
-
-        headers = {
-            'Content-Disposition': f'attachment; filename="presence_overview_{year}_{month}_{employee.name}_{employee.surname}.xlsx"'
-        }
-        return Response(content=excel_output.getvalue(), media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", headers=headers)
-    else:        
+    if employee is None:
         raise HTTPException(status_code=404, detail="Data is not present for current month")
+    return revision, employee
+
+
+@app.get("/export_original_presence_overview/{user_id}/{year}/{month}")
+def export_presence_overview(user_id: int, year: str, month: str, request: Request, db: Session = Depends(get_read_db)):
+    revision, employee = export_month_revision(db, user_id, year, month)
+
+    def render():
+        overview = get_employee_overview(user_id, month, year, db)
+        presence_data = get_month_presences(db, DailyPresence, user_id, year, month)
+        if not presence_data:
+            raise HTTPException(status_code=404, detail="Data is not present for current month")
+        return create_excel_original(presence_data, overview).getvalue()
+
+    return export_response(request, export_cache.key("original-xlsx", employee, year, month, revision), render,
+                           XLSX_MEDIA_TYPE, f"presence_overview_{year}_{month}_{employee.name}_{employee.surname}.xlsx")
+
+
+def pdf_renderer_param(renderer: Optional[str]) -> str:
+    renderer = renderer or settings.PDF_RENDERER
+    if renderer not in PDF_RENDERERS:
+        raise HTTPException(status_code=400, detail=f"Unknown PDF renderer, use one of: {', '.join(PDF_RENDERERS)}")
+    return renderer
 
 
 @app.get("/export_modified_presence_overview/{user_id}/{year}/{month}/{pdfBool}")
-def export_presence_overview(user_id: int, year: str, month: str,pdfBool:bool, db: Session = Depends(get_db)):
-    if month == '12':
-        presence_data = (
-        db.query(AdminModifiedPresence)
-        .filter(AdminModifiedPresence.employee_id == user_id,
-                AdminModifiedPresence.date >= datetime.strptime(year + month, "%Y%m"),
-                AdminModifiedPresence.date <= datetime(int(year),int(month) , 31))
-        .order_by(AdminModifiedPresence.date).all())
-    else:
-        presence_data = (
-            db.query(AdminModifiedPresence)
-            .filter(AdminModifiedPresence.employee_id == user_id,
-                    AdminModifiedPresence.date >= datetime.strptime(year + month, "%Y%m"),
-                    AdminModifiedPresence.date < datetime(int(year), int(month) + 1, 1))
-            .order_by(AdminModifiedPresence.date).all())
-    employee = db.query(User).filter(User.id == user_id).first()
-    if presence_data:
-        excel_output = create_excel_modified(presence_data, employee)
-        filename_base = f"presence_overview_{year}_{month}_{employee.name}_{employee.surname}"
-        temp_excel_path = f"/tmp/{filename_base}.xlsx"
-        with open(temp_excel_path, "wb") as f:
-            f.write(excel_output.getvalue())
-
-        if pdfBool:
-            convert_command = [
-                "libreoffice", "--headless", "--convert-to", "pdf", "--outdir", "/tmp", temp_excel_path]
-            result = subprocess.run(convert_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-            if result.returncode != 0:
+def export_presence_overview(user_id: int, year: str, month: str,pdfBool:bool, request: Request,
+                             renderer: Optional[str] = None, db: Session = Depends(get_read_db)):
+    revision, employee = export_month_revision(db, user_id, year, month)
+    filename_base = f"presence_overview_{year}_{month}_{employee.name}_{employee.surname}"
+    xlsx_key = export_cache.key("modified-xlsx", employee, year, month, revision)
+
+    def month_presences():
+        presence_data = get_month_presences(db, AdminModifiedPresence, user_id, year, month)
+        if not presence_data:
+            raise HTTPException(status_code=404, detail="Data is not present for current month")
+        return presence_data
+
+    def render_xlsx():
+        return create_excel_modified(month_presences(), employee).getvalue()
+
+    if pdfBool:
+        renderer = pdf_renderer_param(renderer)
+
+        def render_pdf():
+            if renderer == NATIVE:
+                return render_modified_pdf(month_presences(), employee)
+            try:
+                return xlsx_to_pdf(export_cache.get_or_render(xlsx_key, render_xlsx))
+            except ConversionError as e:
+                print(f"Failed to convert {filename_base} to PDF: {e}")
                 raise HTTPException(status_code=500, detail="Failed to convert Excel to PDF.")
 
-            pdf_path = f"/tmp/{filename_base}.pdf"
-            if not os.path.exists(pdf_path):
-                raise HTTPException(status_code=500, detail="PDF file not generated.")
+        return export_response(request, export_cache.key(f"modified-pdf-{renderer}", employee, year, month, revision),
+                               render_pdf, "application/pdf", f"{filename_base}.pdf")
 
-            return FileResponse(path=pdf_path, filename=f"{filename_base}.pdf", media_type="application/pdf")
-        
-        else:
-            headers = {
-                'Content-Disposition': f'attachment; filename="{filename_base}.xlsx"'
-            }
-            return Response(content=excel_output.getvalue(),
-                            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                            headers=headers)
-
-    else:        
-        raise HTTPException(status_code=404, detail="Data is not present for current month")
+    return export_response(request, xlsx_key, render_xlsx, XLSX_MEDIA_TYPE, f"{filename_base}.xlsx")
     
 
 @app.get("/export_all_modified_presence_overview/{year}/{month}/{pdfBool}")
-def export_presence_overview(year: str, month: str,pdfBool:bool, db: Session = Depends(get_db)):
-    allEmployees = get_all_employees(db)
-    submitted_employees = []
-    for employee in allEmployees:
-        if has_admin_submitted_presence(employee.id, year=year, month=month, db=db):
-            submitted_employees.append(employee)
-    zip_buffer = BytesIO()
-    with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
-        for employee in submitted_employees:
-            if month == '12':
-                end_day = 31
-            else:
-                end_day = (datetime(int(year), int(month) + 1, 1) - timedelta(days=1)).day
-            
-            presence_data = (
-                db.query(AdminModifiedPresence)
-                .filter(
-                    AdminModifiedPresence.employee_id == employee.id,
-                    AdminModifiedPresence.date >= datetime.strptime(year + month, "%Y%m"),
-                    AdminModifiedPresence.date <= datetime(int(year), int(month), end_day)
-                )
-                .order_by(AdminModifiedPresence.date)
-                .all()
-            )
-
-            if presence_data:
-                filename_base = f"presence_overview_{year}_{month}_{employee.name}_{employee.surname}"
-
-                excel_output = create_excel_modified(presence_data, employee)
-                zip_file.writestr(f"{filename_base}.xlsx", excel_output.getvalue())
-
-                if pdfBool:
-                    # Save Excel to temp file
-                    with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as tmp_excel:
-                        tmp_excel.write(excel_output.getvalue())
-                        tmp_excel.flush()
-                        tmp_excel_path = tmp_excel.name
-
-                    convert_cmd = [
-                        "libreoffice", "--headless", "--convert-to", "pdf",
-                        "--outdir", tempfile.gettempdir(), tmp_excel_path
-                    ]
-                    result = subprocess.run(convert_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-                    if result.returncode != 0:
-                        raise HTTPException(status_code=500, detail="Failed to convert Excel to PDF.")
-
-                    pdf_path = os.path.join(
-                        tempfile.gettempdir(),
-                        f"{os.path.splitext(os.path.basename(tmp_excel_path))[0]}.pdf"
-                    )
-                    with open(pdf_path, "rb") as pdf_file:
-                        zip_file.writestr(f"{filename_base}.pdf", pdf_file.read())
-
-                    os.remove(tmp_excel_path)
-                    os.remove(pdf_path)
-
-    zip_buffer.seek(0)
-
+def export_presence_overview(year: str, month: str,pdfBool:bool, renderer: Optional[str] = None,
+                             db: Session = Depends(get_read_db)):
+    renderer = pdf_renderer_param(renderer)
+    submitted_employees, _ = get_month_submission_status(db, year, month, model=AdminModifiedPresence)
+    presences = get_company_month_presences(db, AdminModifiedPresence, [employee.id for employee in submitted_employees],
+                                            year, month)
+    try:
+        archive = stream_month_archive(submitted_employees, presences, year, month, pdfBool, renderer)
+    except ConversionError:
+        raise HTTPException(status_code=500, detail="Failed to convert Excel to PDF.")
     headers = {'Content-Disposition': f'attachment; filename="presence_overview_{year}_{month}.zip"'}
+    return StreamingResponse(archive, media_type="application/x-zip-compressed", headers=headers)
+
+
+@app.get("/payroll_export/{year}/{month}/{file_format}")
+def export_month_payroll(year: int, month: int, file_format: str, request: Request,
+                         current_user: User = Depends(get_current_user)):
+    # Carries the IBANs of every employee
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can export the payroll")
+    if not 1 <= month <= 12:
+        raise HTTPException(status_code=400, detail="Invalid month")
+    if file_format not in PAYROLL_WRITERS:
+        raise HTTPException(status_code=400, detail=f"Unknown format, use one of: {', '.join(PAYROLL_WRITERS)}")
+    if file_format == "parquet" and not parquet_supported():
+        raise HTTPException(status_code=501, detail="Parquet exports need pyarrow")
+    headers = {'Content-Disposition': f'attachment; filename="payroll_{year}_{month:02d}.{file_format}"'}
+    return StreamingResponse(stream_payroll(read_session_factory(request), year, month, file_format,
+                                            settings.PAYROLL_EXPORT_BATCH_ROWS),
+                             media_type=PAYROLL_MEDIA_TYPES[file_format], headers=headers)
+
+
+@app.post("/export-jobs", response_model=ExportJobStatus, status_code=status.HTTP_202_ACCEPTED)
+def create_export_job(request: ExportJobRequest, db: Session = Depends(get_db),
+                      current_user: User = Depends(get_current_user)):
+    # Run by export_worker.py, poll the job for its progress
+    return enqueue_export_job(db, request.year, request.month, request.pdf, current_user.id)
+
+
+@app.get("/export-jobs/{job_id}", response_model=ExportJobStatus)
+def get_export_job(job_id: str, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    job = db.get(ExportJob, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Export not found or expired")
+    return job
+
+
+@app.get("/export-jobs/{job_id}/download")
+def download_export_job(job_id: str, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    job = db.get(ExportJob, job_id)
+    if job is None or (job.status == DONE and not os.path.exists(job.file_path)):
+        raise HTTPException(status_code=404, detail="Export not found or expired")
+    if job.status != DONE:
+        raise HTTPException(status_code=409, detail=f"Export is {job.status}")
+    return FileResponse(path=job.file_path, filename=f"presence_overview_{job.year}_{job.month:02d}.zip",
+                        media_type="application/x-zip-compressed")
+
+
+@app.get("/db-pool-status", response_model=dict)
+async def get_db_pool_status(current_user: User = Depends(get_current_user)):
+    status = {"sync": pool_status(engine), "async": pool_status(async_engine)}
+    if read_engine is not engine:
+        status["replica"] = pool_status(read_engine)
+    return status
 
-    return Response(content=zip_buffer.getvalue(), media_type="application/x-zip-compressed", headers=headers)
-    
 
 """@app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
@@ -792,8 +559,9 @@ async def send_otp(request: EmailOTPRequest):
     if not email.endswith("@storelink.it"):
         raise HTTPException(status_code=400, detail="Only company emails are allowed")
     otp_code=generate_otp()
-    otp_storage[email] = otp_code
-    send_otp_email(email, otp_code) 
+    await otp_store.put(email, otp_code)
+    # smtplib blocks, keep it off the event loop
+    await run_in_threadpool(send_otp_email, email, otp_code)
 
     return {"message": "OTP sent successfully"}   
 
@@ -803,8 +571,7 @@ async def verify_otp(request: OTPVerifyRequest):
 
     email = request.email.strip().lower()
     otp = request.otp
-    if otp_storage.get(email) == otp:
-        del otp_storage[email]
+    if await otp_store.verify(email, otp):
         return {"message": "OTP verified successfully"}
     else:
         raise HTTPException(status_code=400, detail="Invalid or expired OTP")
@@ -0,0 +1,57 @@
+"""unique presence per employee day
+
+Revision ID: 3f9a1c7d2e45
+Revises: ea518b0680be
+Create Date: 2026-10-18 09:12:41.530218
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f9a1c7d2e45'
+down_revision: Union[str, None] = 'ea518b0680be'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Older submissions could create duplicate rows for the same day; keep the newest one
+    op.execute("""
+        DELETE FROM admin_modified_presence a
+        USING admin_modified_presence b
+        WHERE a.employee_id = b.employee_id
+          AND a.date = b.date
+          AND a.id < b.id
+    """)
+    op.execute("""
+        UPDATE admin_modified_presence a
+        SET original_presence_id = keep.id
+        FROM daily_presence dup
+        JOIN (SELECT employee_id, date, max(id) AS id
+              FROM daily_presence
+              GROUP BY employee_id, date) keep
+          ON keep.employee_id = dup.employee_id AND keep.date = dup.date
+        WHERE a.original_presence_id = dup.id
+          AND dup.id <> keep.id
+    """)
+    op.execute("""
+        DELETE FROM daily_presence a
+        USING daily_presence b
+        WHERE a.employee_id = b.employee_id
+          AND a.date = b.date
+          AND a.id < b.id
+    """)
+
+    op.create_index('ix_daily_presence_employee_id_date', 'daily_presence',
+                    ['employee_id', 'date'], unique=True)
+    op.create_index('ix_admin_modified_presence_employee_id_date', 'admin_modified_presence',
+                    ['employee_id', 'date'], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_admin_modified_presence_employee_id_date', table_name='admin_modified_presence')
+    op.drop_index('ix_daily_presence_employee_id_date', table_name='daily_presence')
@@ -0,0 +1,53 @@
+"""add employee month summary
+
+Revision ID: b71e04c9d2a3
+Revises: 3f9a1c7d2e45
+Create Date: 2026-10-18 10:04:17.284630
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b71e04c9d2a3'
+down_revision: Union[str, None] = '3f9a1c7d2e45'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    columns = []
+    for prefix in ('', 'modified_'):
+        columns += [
+            sa.Column(f'{prefix}worked_hours', sa.Float(), server_default='0', nullable=False),
+            sa.Column(f'{prefix}extra_hours', sa.Float(), server_default='0', nullable=False),
+            sa.Column(f'{prefix}off_hours', sa.Float(), server_default='0', nullable=False),
+            sa.Column(f'{prefix}off_days', sa.Integer(), server_default='0', nullable=False),
+            sa.Column(f'{prefix}expected_hours', sa.Integer(), server_default='0', nullable=False),
+            sa.Column(f'{prefix}extra_hours_days', sa.Text(), server_default='', nullable=False),
+            sa.Column(f'{prefix}off_hours_days', sa.Text(), server_default='', nullable=False),
+            sa.Column(f'{prefix}days_off_days', sa.Text(), server_default='', nullable=False),
+            sa.Column(f'{prefix}notes', sa.Text(), server_default='', nullable=False),
+        ]
+    op.create_table('employee_month_summary',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('employee_id', sa.Integer(), nullable=False),
+    sa.Column('year', sa.Integer(), nullable=False),
+    sa.Column('month', sa.Integer(), nullable=False),
+    *columns,
+    sa.ForeignKeyConstraint(['employee_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_employee_month_summary_id'), 'employee_month_summary', ['id'], unique=False)
+    op.create_index('ix_employee_month_summary_employee_id_year_month', 'employee_month_summary',
+                    ['employee_id', 'year', 'month'], unique=True)
+    # Existing months are filled in with: python rebuild_month_summary.py
+
+
+def downgrade() -> None:
+    op.drop_index('ix_employee_month_summary_employee_id_year_month', table_name='employee_month_summary')
+    op.drop_index(op.f('ix_employee_month_summary_id'), table_name='employee_month_summary')
+    op.drop_table('employee_month_summary')
@@ -0,0 +1,26 @@
+"""add revision to employee month summary
+
+Revision ID: b9d4f2a6c8e1
+Revises: a8e2d5c3b1f4
+Create Date: 2026-10-18 19:02:37.514286
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b9d4f2a6c8e1'
+down_revision: Union[str, None] = 'a8e2d5c3b1f4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('employee_month_summary', sa.Column('revision', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('employee_month_summary', 'revision')
@@ -0,0 +1,108 @@
+"""partition presence tables by year
+
+Revision ID: c5d8e2f41a67
+Revises: b71e04c9d2a3
+Create Date: 2026-10-18 11:42:09.517203
+
+"""
+from datetime import date
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c5d8e2f41a67'
+down_revision: Union[str, None] = 'b71e04c9d2a3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TABLES = ('daily_presence', 'admin_modified_presence')
+YEARS_AHEAD = 2
+
+
+def rename_to_old(table: str) -> None:
+    # Frees the table, primary key and index names for the new table
+    op.execute(f'ALTER TABLE {table} RENAME TO {table}_old')
+    op.execute(f'ALTER TABLE {table}_old RENAME CONSTRAINT {table}_pkey TO {table}_old_pkey')
+    op.execute(f'ALTER INDEX ix_{table}_id RENAME TO ix_{table}_old_id')
+    op.execute(f'ALTER INDEX ix_{table}_employee_id_date RENAME TO ix_{table}_old_employee_id_date')
+
+
+def create_like_old(table: str, partitioned: bool) -> None:
+    partition_clause = ' PARTITION BY RANGE (date)' if partitioned else ''
+    primary_key = 'id, date' if partitioned else 'id'
+    op.execute(f'CREATE TABLE {table} (LIKE {table}_old INCLUDING DEFAULTS){partition_clause}')
+    op.execute(f'ALTER TABLE {table} ADD CONSTRAINT {table}_pkey PRIMARY KEY ({primary_key})')
+    op.execute(f'CREATE INDEX ix_{table}_id ON {table} (id)')
+    op.execute(f'CREATE UNIQUE INDEX ix_{table}_employee_id_date ON {table} (employee_id, date)')
+    op.execute(f'ALTER TABLE {table} ADD CONSTRAINT {table}_employee_id_fkey '
+               f'FOREIGN KEY (employee_id) REFERENCES users (id)')
+
+
+def move_rows(table: str) -> None:
+    op.execute(f'INSERT INTO {table} SELECT * FROM {table}_old')
+    # Keep the id sequence alive when the old table goes away
+    op.execute(f'ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id')
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    # A foreign key into a partitioned table has to include the partition key, so
+    # original_presence_id is aligned with the daily row of the same employee and day first
+    op.execute('ALTER TABLE admin_modified_presence DROP CONSTRAINT admin_modified_presence_original_presence_id_fkey')
+    op.execute('''
+        UPDATE admin_modified_presence a SET original_presence_id = d.id
+        FROM daily_presence d
+        WHERE d.employee_id = a.employee_id AND d.date = a.date
+          AND a.original_presence_id IS DISTINCT FROM d.id
+    ''')
+    op.execute('''
+        UPDATE admin_modified_presence a SET original_presence_id = NULL
+        WHERE NOT EXISTS (SELECT 1 FROM daily_presence d WHERE d.id = a.original_presence_id AND d.date = a.date)
+    ''')
+
+    for table in TABLES:
+        rename_to_old(table)
+        create_like_old(table, partitioned=True)
+
+    first_year = op.get_bind().execute(sa.text(
+        'SELECT min(extract(year FROM date))::int FROM '
+        '(SELECT date FROM daily_presence_old UNION ALL SELECT date FROM admin_modified_presence_old) AS presences'
+    )).scalar()
+    last_year = date.today().year + YEARS_AHEAD
+    for year in range(min(first_year or last_year, date.today().year), last_year + 1):
+        for table in TABLES:
+            op.execute(f"CREATE TABLE {table}_y{year} PARTITION OF {table} "
+                       f"FOR VALUES FROM ('{year}-01-01') TO ('{year + 1}-01-01')")
+    # Rows of a year without its own partition (yet) land here instead of failing
+    for table in TABLES:
+        op.execute(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT")
+
+    for table in TABLES:
+        move_rows(table)
+    op.execute('ALTER TABLE admin_modified_presence ADD CONSTRAINT admin_modified_presence_original_presence_fkey '
+               'FOREIGN KEY (original_presence_id, date) REFERENCES daily_presence (id, date)')
+
+    op.execute('DROP TABLE admin_modified_presence_old')
+    op.execute('DROP TABLE daily_presence_old')
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    op.execute('ALTER TABLE admin_modified_presence DROP CONSTRAINT admin_modified_presence_original_presence_fkey')
+    for table in TABLES:
+        rename_to_old(table)
+        create_like_old(table, partitioned=False)
+        move_rows(table)
+    op.execute('ALTER TABLE admin_modified_presence ADD CONSTRAINT admin_modified_presence_original_presence_id_fkey '
+               'FOREIGN KEY (original_presence_id) REFERENCES daily_presence (id)')
+
+    # Drops the yearly and default partitions along with their parents
+    op.execute('DROP TABLE admin_modified_presence_old')
+    op.execute('DROP TABLE daily_presence_old')
@@ -0,0 +1,26 @@
+"""add token version to users
+
+Revision ID: d2b7f09e6c31
+Revises: c5d8e2f41a67
+Create Date: 2026-10-18 14:08:51.903114
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd2b7f09e6c31'
+down_revision: Union[str, None] = 'c5d8e2f41a67'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('users', sa.Column('token_version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('users', 'token_version')
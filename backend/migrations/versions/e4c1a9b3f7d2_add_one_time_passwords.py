@@ -0,0 +1,34 @@
+"""add one time passwords
+
+Revision ID: e4c1a9b3f7d2
+Revises: d2b7f09e6c31
+Create Date: 2026-10-18 15:21:37.460912
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e4c1a9b3f7d2'
+down_revision: Union[str, None] = 'd2b7f09e6c31'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('one_time_passwords',
+    sa.Column('email', sa.String(), nullable=False),
+    sa.Column('code_hash', sa.String(), nullable=False),
+    sa.Column('expires_at', sa.DateTime(), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('email')
+    )
+    op.create_index(op.f('ix_one_time_passwords_expires_at'), 'one_time_passwords', ['expires_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_one_time_passwords_expires_at'), table_name='one_time_passwords')
+    op.drop_table('one_time_passwords')
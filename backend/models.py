@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Integer, Date, Boolean, ForeignKey, Time, Text
+from sqlalchemy import Column, String, Integer, Date, DateTime, Boolean, ForeignKey, Time, Text, Index, Float
 from sqlalchemy.orm import relationship, declarative_base
 
 
@@ -21,6 +21,7 @@ class User(Base):
     iban = Column(String, nullable=True)
     is_active = Column(Boolean, default=True)
     password = Column(String, nullable=False)  # Password hash
+    token_version = Column(Integer, nullable=False, default=0, server_default='0')  # Bumped to revoke issued tokens
 
     # Relationships
     daily_presences = relationship('DailyPresence', back_populates='employee', cascade="all, delete-orphan")
@@ -39,6 +40,12 @@ class User(Base):
 
 class DailyPresence(Base):
     __tablename__ = 'daily_presence'
+    # On Postgres both presence tables are range partitioned by year (see partitions.py), the
+    # primary key there is (id, date) but id stays unique through its sequence
+    __table_args__ = (
+        # One row per employee per day; also the conflict target for monthly upserts
+        Index('ix_daily_presence_employee_id_date', 'employee_id', 'date', unique=True),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     employee_id = Column(Integer, ForeignKey('users.id'))
@@ -96,6 +103,9 @@ class NationalHolidays(Base):
 
 class AdminModifiedPresence(Base):
     __tablename__ = 'admin_modified_presence'
+    __table_args__ = (
+        Index('ix_admin_modified_presence_employee_id_date', 'employee_id', 'date', unique=True),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     employee_id = Column(Integer, ForeignKey('users.id'))
@@ -118,4 +128,104 @@ class AdminModifiedPresence(Base):
         'DailyPresence',
         back_populates='admin_modification',
         uselist=False  # Ensures one-to-one relationship
-    )
\ No newline at end of file
+    )
+
+
+class EmployeeMonthSummary(Base):
+    __tablename__ = 'employee_month_summary'
+    __table_args__ = (
+        Index('ix_employee_month_summary_employee_id_year_month', 'employee_id', 'year', 'month', unique=True),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    employee_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    year = Column(Integer, nullable=False)
+    month = Column(Integer, nullable=False)
+    revision = Column(Integer, nullable=False, default=1, server_default='1')  # Bumped on every write to the month
+
+    # Figures from DailyPresence, as submitted by the employee
+    worked_hours = Column(Float, nullable=False, default=0)
+    extra_hours = Column(Float, nullable=False, default=0)
+    off_hours = Column(Float, nullable=False, default=0)
+    off_days = Column(Integer, nullable=False, default=0)
+    expected_hours = Column(Integer, nullable=False, default=0)
+    extra_hours_days = Column(Text, nullable=False, default='')
+    off_hours_days = Column(Text, nullable=False, default='')
+    days_off_days = Column(Text, nullable=False, default='')
+    notes = Column(Text, nullable=False, default='')
+
+    # Same figures from AdminModifiedPresence
+    modified_worked_hours = Column(Float, nullable=False, default=0)
+    modified_extra_hours = Column(Float, nullable=False, default=0)
+    modified_off_hours = Column(Float, nullable=False, default=0)
+    modified_off_days = Column(Integer, nullable=False, default=0)
+    modified_expected_hours = Column(Integer, nullable=False, default=0)
+    modified_extra_hours_days = Column(Text, nullable=False, default='')
+    modified_off_hours_days = Column(Text, nullable=False, default='')
+    modified_days_off_days = Column(Text, nullable=False, default='')
+    modified_notes = Column(Text, nullable=False, default='')
+
+
+class OneTimePassword(Base):
+    __tablename__ = 'one_time_passwords'
+
+    email = Column(String, primary_key=True)
+    code_hash = Column(String, nullable=False)  # sha256 of the code
+    expires_at = Column(DateTime, nullable=False, index=True)  # UTC
+    attempts = Column(Integer, nullable=False, default=0)
+
+
+class UserSession(Base):
+    """A refresh token; the token itself is only handed to the client."""
+    __tablename__ = 'user_sessions'
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
+    token_hash = Column(String(64), nullable=False, unique=True)  # sha256, replaced on every rotation
+    token_version = Column(Integer, nullable=False)  # users.token_version when the session was opened
+    expires_at = Column(DateTime, nullable=False)  # UTC, not extended by rotation
+
+
+class EmailOutbox(Base):
+    """Outgoing mail, delivered by mail_worker.py."""
+    __tablename__ = 'email_outbox'
+    __table_args__ = (
+        # The worker claims the oldest claimable rows of a status
+        Index('ix_email_outbox_status_available_at', 'status', 'available_at'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    receiver_email = Column(String, nullable=False)
+    subject = Column(String, nullable=False)
+    body = Column(Text, nullable=False)
+    status = Column(String(16), nullable=False, default='pending')  # pending, sending, sent or failed
+    attempts = Column(Integer, nullable=False, default=0)
+    # UTC. When a pending row may be claimed, or when the lease of a sending row runs out
+    available_at = Column(DateTime, nullable=False)
+    created_at = Column(DateTime, nullable=False)
+    sent_at = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+
+
+class ExportJob(Base):
+    """A company-wide month export, run by export_worker.py."""
+    __tablename__ = 'export_jobs'
+    __table_args__ = (
+        Index('ix_export_jobs_status_available_at', 'status', 'available_at'),
+    )
+
+    id = Column(String(32), primary_key=True)  # random, it is also the download handle
+    requested_by_id = Column(Integer, ForeignKey('users.id', ondelete='SET NULL'), nullable=True)
+    year = Column(Integer, nullable=False)
+    month = Column(Integer, nullable=False)
+    pdf = Column(Boolean, nullable=False, default=False)
+    status = Column(String(16), nullable=False, default='pending')  # pending, running, done or failed
+    total = Column(Integer, nullable=True)  # employees in the archive, known once running
+    completed = Column(Integer, nullable=False, default=0)
+    attempts = Column(Integer, nullable=False, default=0)
+    # UTC. When a pending job may be claimed, or when the lease of a running job runs out
+    available_at = Column(DateTime, nullable=False)
+    created_at = Column(DateTime, nullable=False)
+    finished_at = Column(DateTime, nullable=True)
+    file_path = Column(String, nullable=True)
+    error = Column(Text, nullable=True)
@@ -0,0 +1,132 @@
+import abc
+import asyncio
+import hashlib
+import hmac
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, update
+
+from config import settings
+from CRUD import upsert_statement
+from database import AsyncSessionLocal
+from models import OneTimePassword
+
+
+def code_digest(code: str) -> str:
+    return hashlib.sha256(code.encode()).hexdigest()
+
+
+class OTPStore(abc.ABC):
+    """One pending code per email, dropped when verified, expired or guessed wrong max_attempts times."""
+
+    def __init__(self, ttl: int, max_attempts: int, sweep_interval: int):
+        self.ttl = ttl
+        self.max_attempts = max_attempts
+        self.sweep_interval = sweep_interval
+        self._sweeper = None
+
+    @abc.abstractmethod
+    async def put(self, email: str, code: str):
+        """Stores a new code for email, replacing any pending one and its attempts."""
+
+    @abc.abstractmethod
+    async def verify(self, email: str, code: str) -> bool:
+        """Whether code is the pending code of email, counting the attempt."""
+
+    @abc.abstractmethod
+    async def sweep(self):
+        """Removes the expired codes."""
+
+    def start(self):
+        if self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._sweep_forever())
+
+    async def stop(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+
+    async def _sweep_forever(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                print(f"OTP sweep failed: {e}")
+
+
+class MemoryOTPStore(OTPStore):
+    """Codes live in this process only, so every request of a flow must reach the same worker."""
+
+    def __init__(self, ttl: int, max_attempts: int, sweep_interval: int):
+        super().__init__(ttl, max_attempts, sweep_interval)
+        self._codes = {}  # email -> [code hash, expires at (monotonic), attempts]
+        self._lock = threading.Lock()
+
+    async def put(self, email: str, code: str):
+        with self._lock:
+            self._codes[email] = [code_digest(code), time.monotonic() + self.ttl, 0]
+
+    async def verify(self, email: str, code: str) -> bool:
+        with self._lock:
+            entry = self._codes.get(email)
+            if entry is None or entry[1] <= time.monotonic():
+                self._codes.pop(email, None)
+                return False
+            entry[2] += 1
+            verified = hmac.compare_digest(entry[0], code_digest(code))
+            if verified or entry[2] >= self.max_attempts:
+                del self._codes[email]
+            return verified
+
+    async def sweep(self):
+        now = time.monotonic()
+        with self._lock:
+            for email in [email for email, entry in self._codes.items() if entry[1] <= now]:
+                del self._codes[email]
+
+
+class DatabaseOTPStore(OTPStore):
+    """Codes live in the one_time_passwords table, shared by every worker."""
+
+    async def put(self, email: str, code: str):
+        values = {"code_hash": code_digest(code), "expires_at": datetime.utcnow() + timedelta(seconds=self.ttl),
+                  "attempts": 0}
+        async with AsyncSessionLocal() as db:
+            statement = upsert_statement(db, OneTimePassword).values(email=email, **values)
+            await db.execute(statement.on_conflict_do_update(index_elements=[OneTimePassword.email], set_=values))
+            await db.commit()
+
+    async def verify(self, email: str, code: str) -> bool:
+        async with AsyncSessionLocal() as db:
+            # Counting the attempt locks the row, so concurrent guesses are checked one at a time
+            row = (await db.execute(
+                update(OneTimePassword)
+                .where(OneTimePassword.email == email, OneTimePassword.expires_at > datetime.utcnow())
+                .values(attempts=OneTimePassword.attempts + 1)
+                .returning(OneTimePassword.code_hash, OneTimePassword.attempts)
+            )).first()
+            if row is None:
+                return False
+            verified = hmac.compare_digest(row.code_hash, code_digest(code))
+            if verified or row.attempts >= self.max_attempts:
+                await db.execute(delete(OneTimePassword).where(OneTimePassword.email == email))
+            await db.commit()
+            return verified
+
+    async def sweep(self):
+        async with AsyncSessionLocal() as db:
+            await db.execute(delete(OneTimePassword).where(OneTimePassword.expires_at <= datetime.utcnow()))
+            await db.commit()
+
+
+OTP_STORES = {"memory": MemoryOTPStore, "database": DatabaseOTPStore}
+
+
+def create_otp_store() -> OTPStore:
+    if settings.OTP_STORE not in OTP_STORES:
+        raise ValueError(f"OTP_STORE must be one of {', '.join(OTP_STORES)}, not {settings.OTP_STORE!r}")
+    return OTP_STORES[settings.OTP_STORE](settings.OTP_TTL_SECONDS, settings.OTP_MAX_ATTEMPTS,
+                                          settings.OTP_SWEEP_INTERVAL_SECONDS)
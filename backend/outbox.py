@@ -0,0 +1,88 @@
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.orm import Session
+
+from mail import is_transient
+from models import EmailOutbox
+
+
+PENDING, SENDING, SENT, FAILED = "pending", "sending", "sent", "failed"
+
+
+def enqueue_emails(db: Session, receiver_emails: List[str], subject: str, body: str):
+    """Adds one outbox row per receiver to the session (sync or async), the caller commits."""
+    now = datetime.utcnow()
+    db.add_all([EmailOutbox(receiver_email=receiver_email, subject=subject, body=body, status=PENDING,
+                            attempts=0, available_at=now, created_at=now)
+                for receiver_email in receiver_emails])
+
+
+def claim_batch(db: Session, batch_size: int, lease_seconds: int):
+    """Marks up to batch_size claimable rows as sending and returns them; concurrent workers skip each other's rows."""
+    now = datetime.utcnow()
+    # A sending row whose lease ran out belongs to a worker that died mid batch
+    claimable = (select(EmailOutbox.id)
+                 .where(EmailOutbox.status.in_((PENDING, SENDING)), EmailOutbox.available_at <= now)
+                 .order_by(EmailOutbox.id)
+                 .limit(batch_size)
+                 .with_for_update(skip_locked=True))
+    rows = db.execute(
+        update(EmailOutbox)
+        .where(EmailOutbox.id.in_(claimable.scalar_subquery()))
+        .values(status=SENDING, attempts=EmailOutbox.attempts + 1,
+                available_at=now + timedelta(seconds=lease_seconds))
+        .returning(EmailOutbox.id, EmailOutbox.receiver_email, EmailOutbox.subject, EmailOutbox.body,
+                   EmailOutbox.attempts)
+        .execution_options(synchronize_session=False)
+    ).all()
+    db.commit()
+    return sorted(rows, key=lambda row: row.id)
+
+
+def record_results(db: Session, rows, errors: List[Optional[Exception]], max_attempts: int, retry_backoff: float):
+    """Stores the outcome of a claimed batch; returns the (sent, retried, failed) counts."""
+    now = datetime.utcnow()
+    changes = []
+    counts = {SENT: 0, PENDING: 0, FAILED: 0}
+    for row, error in zip(rows, errors):
+        if error is None:
+            change = {"status": SENT, "sent_at": now, "last_error": None}
+        elif is_transient(error) and row.attempts < max_attempts:
+            change = {"status": PENDING, "last_error": str(error),
+                      "available_at": now + timedelta(seconds=retry_backoff * 2 ** (row.attempts - 1))}
+        else:
+            change = {"status": FAILED, "last_error": str(error)}
+        counts[change["status"]] += 1
+        changes.append({"id": row.id, **change})
+    if changes:
+        # Bulk UPDATE by primary key, one executemany per distinct set of columns
+        db.execute(update(EmailOutbox), changes)
+        db.commit()
+    return counts[SENT], counts[PENDING], counts[FAILED]
+
+
+def purge_sent(db: Session, retention_days: int) -> int:
+    result = db.execute(delete(EmailOutbox).where(EmailOutbox.status == SENT,
+                                                  EmailOutbox.sent_at < datetime.utcnow() - timedelta(days=retention_days)))
+    db.commit()
+    return result.rowcount
+
+
+def outbox_status(db: Session) -> dict:
+    """Backlog and throughput counters of the outbox, shared by every worker."""
+    now = datetime.utcnow()
+    backlog = EmailOutbox.status.in_((PENDING, SENDING))
+    row = db.execute(select(
+        func.count().filter(EmailOutbox.status == PENDING).label(PENDING),
+        func.count().filter(EmailOutbox.status == SENDING).label(SENDING),
+        func.count().filter(EmailOutbox.status == FAILED).label(FAILED),
+        func.min(EmailOutbox.created_at).filter(backlog).label("oldest_queued_at"),
+        func.count().filter(EmailOutbox.sent_at >= now - timedelta(minutes=1)).label("sent_last_minute"),
+        func.count().filter(EmailOutbox.sent_at >= now - timedelta(hours=1)).label("sent_last_hour"),
+    )).one()
+    status = dict(row._mapping)
+    oldest_queued_at = status.pop("oldest_queued_at")
+    status["oldest_queued_seconds"] = (now - oldest_queued_at).total_seconds() if oldest_queued_at else 0
+    return status
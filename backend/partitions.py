@@ -0,0 +1,90 @@
+"""Yearly range partitions of the presence tables (Postgres only), and a default partition
+holding the rows of any year without its own.
+
+    python partitions.py ensure          # current year and the next PARTITION_YEARS_AHEAD years
+    python partitions.py ensure 2018     # also every year since 2018
+    python partitions.py detach 2019     # detach one year for archival, the table stays as <table>_y2019
+"""
+import argparse
+from datetime import date
+
+from sqlalchemy import text
+
+from database import engine
+
+
+# Referenced table first: admin_modified_presence has a foreign key to daily_presence
+PARTITIONED_TABLES = ("daily_presence", "admin_modified_presence")
+PARTITION_YEARS_AHEAD = 2
+ORIGINAL_PRESENCE_FKEY = "admin_modified_presence_original_presence_fkey"
+
+
+def partition_name(table: str, year: int) -> str:
+    return f"{table}_y{year}"
+
+
+def default_partition_name(table: str) -> str:
+    return f"{table}_default"
+
+
+def is_partitioned(connection) -> bool:
+    if connection.dialect.name != "postgresql":
+        return False
+    relkind = connection.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass('daily_presence')")).scalar()
+    return relkind == "p"
+
+
+def ensure_presence_partitions(connection, first_year: int = None, last_year: int = None):
+    """Create any missing yearly partition between first_year and last_year (both included), and
+    the default partition taking the rows of the other years."""
+    if not is_partitioned(connection):
+        return
+    for table in PARTITIONED_TABLES:
+        connection.execute(text(f"CREATE TABLE IF NOT EXISTS {default_partition_name(table)} PARTITION OF {table} DEFAULT"))
+    current_year = date.today().year
+    for year in range(first_year or current_year, (last_year or current_year + PARTITION_YEARS_AHEAD) + 1):
+        for table in PARTITIONED_TABLES:
+            if connection.execute(text("SELECT to_regclass(:name)"), {"name": partition_name(table, year)}).scalar():
+                continue
+            # Postgres refuses a partition for rows the default partition already holds, they stay there
+            if connection.execute(text(f"SELECT EXISTS (SELECT 1 FROM {default_partition_name(table)} "
+                                       f"WHERE date >= '{year}-01-01' AND date < '{year + 1}-01-01')")).scalar():
+                print(f"{partition_name(table, year)} not created, {default_partition_name(table)} holds rows of {year}")
+                continue
+            connection.execute(text(
+                f"CREATE TABLE {partition_name(table, year)} PARTITION OF {table} "
+                f"FOR VALUES FROM ('{year}-01-01') TO ('{year + 1}-01-01')"))
+
+
+def detach_presence_year(year: int):
+    """Detach one year from both tables without blocking reads and writes on the other partitions."""
+    # DETACH ... CONCURRENTLY cannot run inside a transaction block
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        if not is_partitioned(connection):
+            raise RuntimeError("The presence tables are not partitioned")
+        for table in reversed(PARTITIONED_TABLES):
+            connection.execute(text(f"ALTER TABLE {table} DETACH PARTITION {partition_name(table, year)} CONCURRENTLY"))
+            if table == "admin_modified_presence":
+                # The detached copy keeps the foreign key, which would block detaching the daily_presence year
+                connection.execute(text(f"ALTER TABLE {partition_name(table, year)} "
+                                        f"DROP CONSTRAINT IF EXISTS {ORIGINAL_PRESENCE_FKEY}"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the yearly presence partitions")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    ensure = subcommands.add_parser("ensure", help="create missing partitions up to the coming years")
+    ensure.add_argument("first_year", type=int, nargs="?")
+    detach = subcommands.add_parser("detach", help="detach one year for archival")
+    detach.add_argument("year", type=int)
+    args = parser.parse_args()
+
+    if args.command == "ensure":
+        with engine.begin() as connection:
+            ensure_presence_partitions(connection, first_year=args.first_year)
+    else:
+        detach_presence_year(args.year)
+
+
+if __name__ == "__main__":
+    main()
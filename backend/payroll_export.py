@@ -0,0 +1,136 @@
+"""The admin-modified month of every employee as data for payroll, in CSV, NDJSON or Parquet.
+
+Rows are read from a server-side cursor and written batch by batch, the memory used does not
+depend on the size of the month.
+"""
+import csv
+import importlib.util
+import json
+from datetime import date, time
+from io import StringIO
+from typing import Callable, Iterable, Iterator
+
+from sqlalchemy.orm import Session
+
+from CRUD import calculate_hours_per_day, stream_month_payroll
+
+
+PAYROLL_COLUMNS = ["employee_id", "name", "surname", "iban", "date",
+                   "entry_time_morning", "exit_time_morning", "entry_time_afternoon", "exit_time_afternoon",
+                   "worked_hours", "extra_hours", "time_off", "day_off", "national_holiday", "weekend",
+                   "illness", "notes"]
+TIME_COLUMNS = {"entry_time_morning", "exit_time_morning", "entry_time_afternoon", "exit_time_afternoon",
+                "extra_hours", "time_off"}
+
+PAYROLL_MEDIA_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def payroll_records(batches: Iterable[list]) -> Iterator[list]:
+    """Batches of rows in PAYROLL_COLUMNS order, with the hours worked each day."""
+    for batch in batches:
+        # The query returns the columns without worked_hours, computed from the four times before it
+        yield [(*row[:9], calculate_hours_per_day(*row[5:9]), *row[9:]) for row in batch]
+
+
+def text_value(value):
+    # NULL stays empty in CSV and null in NDJSON
+    if isinstance(value, time):
+        return value.strftime("%H:%M")
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def write_csv(records: Iterable[list]) -> Iterator[bytes]:
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(PAYROLL_COLUMNS)
+    for batch in records:
+        writer.writerows([text_value(value) for value in record] for record in batch)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def write_ndjson(records: Iterable[list]) -> Iterator[bytes]:
+    for batch in records:
+        yield "".join(json.dumps(dict(zip(PAYROLL_COLUMNS, map(text_value, record))), ensure_ascii=False) + "\n"
+                      for record in batch).encode()
+
+
+class ParquetSink:
+    """Write-only file for the Parquet writer, handing out what was written since the last take().
+
+    The writer records the offset of each row group in the footer, tell() keeps counting from the
+    start of the file although the bytes already handed out are dropped.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def parquet_supported() -> bool:
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def write_parquet(records: Iterable[list]) -> Iterator[bytes]:
+    """One row group per batch."""
+    # Imported here, only the Parquet export needs pyarrow
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    types = {"employee_id": pa.int32(), "date": pa.date32(), "worked_hours": pa.float64(), "day_off": pa.bool_(),
+             "national_holiday": pa.bool_(), "weekend": pa.bool_()}
+    types.update({column: pa.time32("s") for column in TIME_COLUMNS})
+    schema = pa.schema([(column, types.get(column, pa.string())) for column in PAYROLL_COLUMNS])
+
+    sink = ParquetSink()
+    with pq.ParquetWriter(sink, schema, compression="snappy") as writer:
+        for batch in records:
+            if batch:
+                writer.write_table(pa.Table.from_arrays(
+                    [pa.array(column, type=field.type) for column, field in zip(zip(*batch), schema)], schema=schema))
+                yield sink.take()
+    yield sink.take()
+
+
+PAYROLL_WRITERS = {"csv": write_csv, "ndjson": write_ndjson, "parquet": write_parquet}
+
+
+def stream_payroll(session_factory: Callable[[], Session], year, month, file_format: str,
+                   batch_size: int) -> Iterator[bytes]:
+    """The month in file_format (a key of PAYROLL_WRITERS), for a StreamingResponse.
+
+    Reads from a session of its own, open while the response is sent, rather than the request's,
+    which FastAPI may close before the body is done.
+    """
+    with session_factory() as db:
+        yield from PAYROLL_WRITERS[file_format](payroll_records(stream_month_payroll(db, year, month, batch_size)))
@@ -0,0 +1,229 @@
+import itertools
+import json
+import os
+import queue
+import selectors
+import shutil
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+
+from config import settings
+
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "soffice_worker.py")
+
+
+class ConversionError(Exception):
+    pass
+
+
+class ConverterUnresponsive(ConversionError):
+    """The converter timed out or exited, its process is in an unknown state."""
+
+
+class ConverterProcess:
+    """One soffice_worker.py with its own LibreOffice profile and work directory."""
+
+    def __init__(self, python: str, soffice: str, start_timeout: float):
+        self.python = python
+        self.soffice = soffice
+        self.start_timeout = start_timeout
+        self.process = None
+        self.work_dir = None
+        self.jobs = 0
+        self.last_used = 0.0
+        self._buffer = b""
+        self._selector = None
+        self._names = itertools.count()
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        self.work_dir = tempfile.mkdtemp(prefix="presenza-soffice-")
+        profile_dir = os.path.join(self.work_dir, "profile")
+        # New session, so a timeout can kill soffice along with the worker
+        self.process = subprocess.Popen(
+            [self.python, WORKER_SCRIPT, profile_dir, f"presenza-{uuid.uuid4().hex}", self.soffice],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, bufsize=0,
+            start_new_session=True)
+        self._buffer = b""
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self.process.stdout, selectors.EVENT_READ)
+        self.jobs = 0
+        try:
+            self._read_response(self.start_timeout)
+        except ConversionError:
+            self.stop()
+            raise
+        self.last_used = time.monotonic()
+
+    def stop(self):
+        if self.process is not None:
+            try:
+                os.killpg(self.process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            self.process.wait()
+            self.process.stdin.close()
+            self.process.stdout.close()
+            self._selector.close()
+            self.process = None
+        if self.work_dir is not None:
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+            self.work_dir = None
+
+    def _read_response(self, timeout: float) -> dict:
+        deadline = time.monotonic() + timeout
+        while b"\n" not in self._buffer:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self._selector.select(remaining):
+                raise ConverterUnresponsive(f"LibreOffice did not answer within {timeout:.0f} s")
+            chunk = os.read(self.process.stdout.fileno(), 65536)
+            if not chunk:
+                raise ConverterUnresponsive("LibreOffice exited")
+            self._buffer += chunk
+        line, _, self._buffer = self._buffer.partition(b"\n")
+        return json.loads(line)
+
+    def request(self, timeout: float, **request) -> dict:
+        try:
+            self.process.stdin.write((json.dumps(request) + "\n").encode())
+        except OSError:
+            raise ConverterUnresponsive("LibreOffice exited")
+        response = self._read_response(timeout)
+        self.last_used = time.monotonic()
+        if not response.get("ok"):
+            raise ConversionError(response.get("error", "Conversion failed"))
+        return response
+
+    def convert(self, xlsx: bytes, timeout: float) -> bytes:
+        base = os.path.join(self.work_dir, f"job-{next(self._names)}")
+        with open(f"{base}.xlsx", "wb") as f:
+            f.write(xlsx)
+        try:
+            self.request(timeout, input=f"{base}.xlsx", output=f"{base}.pdf")
+            self.jobs += 1
+            with open(f"{base}.pdf", "rb") as f:
+                return f.read()
+        finally:
+            for path in (f"{base}.xlsx", f"{base}.pdf"):
+                if os.path.exists(path):
+                    os.remove(path)
+
+
+class ConverterPool:
+    """Long-lived LibreOffice converters shared by the export endpoints, one conversion per process at a time."""
+
+    def __init__(self, size: int, python: str, soffice: str, convert_timeout: float, queue_timeout: float,
+                 start_timeout: float, max_jobs: int, health_check_after: float):
+        self.size = size
+        self.convert_timeout = convert_timeout
+        self.queue_timeout = queue_timeout
+        self.max_jobs = max_jobs
+        self.health_check_after = health_check_after
+        self._converters = [ConverterProcess(python, soffice, start_timeout) for _ in range(size)]
+        self._idle = queue.Queue()
+        for converter in self._converters:
+            self._idle.put(converter)
+
+    def _ready(self, converter: ConverterProcess):
+        """Restarts the converter when it died, served max_jobs or no longer answers a ping."""
+        if converter.alive and converter.jobs >= self.max_jobs:
+            converter.stop()
+        if converter.alive and time.monotonic() - converter.last_used > self.health_check_after:
+            try:
+                converter.request(min(self.convert_timeout, 10), ping=True)
+            except ConversionError:
+                converter.stop()
+        if not converter.alive:
+            converter.stop()
+            converter.start()
+
+    def convert(self, xlsx: bytes) -> bytes:
+        try:
+            converter = self._idle.get(timeout=self.queue_timeout)
+        except queue.Empty:
+            raise ConversionError("All PDF converters are busy")
+        try:
+            self._ready(converter)
+            return converter.convert(xlsx, self.convert_timeout)
+        except ConverterUnresponsive:
+            # In an unknown state, the next job gets a fresh one. A document LibreOffice rejected
+            # leaves it answering, it is kept
+            converter.stop()
+            raise
+        finally:
+            self._idle.put(converter)
+
+    def warm_up(self):
+        """Starts every converter in the background, so the first exports do not wait for LibreOffice."""
+        def start_all():
+            converters = [self._idle.get() for _ in range(self.size)]
+            try:
+                for converter in converters:
+                    try:
+                        self._ready(converter)
+                    except ConversionError as e:
+                        print(f"Could not start a PDF converter: {e}")
+            finally:
+                for converter in converters:
+                    self._idle.put(converter)
+
+        threading.Thread(target=start_all, name="pdf-converter-warm-up", daemon=True).start()
+
+    def close(self):
+        """Stops the converters, waiting up to convert_timeout for each one still converting."""
+        try:
+            for _ in range(self.size):
+                self._idle.get(timeout=self.convert_timeout).stop()
+        except queue.Empty:
+            # Still busy past the timeout of a conversion, killed under their job. Stopping the
+            # idle ones again does nothing
+            for converter in self._converters:
+                converter.stop()
+
+
+def convert_once(xlsx: bytes, soffice: str, timeout: float) -> bytes:
+    """One-shot soffice --convert-to, with a private profile and directory so parallel calls do not collide."""
+    work_dir = tempfile.mkdtemp(prefix="presenza-soffice-")
+    try:
+        input_path = os.path.join(work_dir, "export.xlsx")
+        with open(input_path, "wb") as f:
+            f.write(xlsx)
+        profile_url = "file://" + os.path.join(work_dir, "profile")
+        try:
+            result = subprocess.run([soffice, "--headless", f"-env:UserInstallation={profile_url}",
+                                     "--convert-to", "pdf", "--outdir", work_dir, input_path],
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            raise ConversionError(f"LibreOffice did not answer within {timeout:.0f} s")
+        pdf_path = os.path.join(work_dir, "export.pdf")
+        if result.returncode != 0 or not os.path.exists(pdf_path):
+            raise ConversionError("Failed to convert Excel to PDF.")
+        with open(pdf_path, "rb") as f:
+            return f.read()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def create_converter_pool() -> ConverterPool:
+    return ConverterPool(settings.PDF_CONVERTERS, settings.LIBREOFFICE_PYTHON, settings.LIBREOFFICE_BINARY,
+                         settings.PDF_CONVERT_TIMEOUT_SECONDS, settings.PDF_QUEUE_TIMEOUT_SECONDS,
+                         settings.PDF_CONVERTER_START_TIMEOUT_SECONDS, settings.PDF_CONVERTER_MAX_JOBS,
+                         settings.PDF_CONVERTER_HEALTH_CHECK_SECONDS)
+
+
+pdf_converter_pool = create_converter_pool()
+
+
+def xlsx_to_pdf(xlsx: bytes) -> bytes:
+    """Blocking, call it from a worker thread."""
+    if settings.PDF_CONVERTERS <= 0:
+        return convert_once(xlsx, settings.LIBREOFFICE_BINARY, settings.PDF_CONVERT_TIMEOUT_SECONDS)
+    return pdf_converter_pool.convert(xlsx)
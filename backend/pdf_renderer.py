@@ -0,0 +1,134 @@
+"""The modified month timesheet drawn straight to PDF, without going through LibreOffice.
+
+Prints the sheet of create_excel_modified the way LibreOffice prints it: A4 portrait with the
+sheet's margins and column widths, the logo over the first six rows, the name and month blocks,
+then one bordered row per day, shaded like the workbook.
+"""
+from io import BytesIO
+from typing import List, Optional
+
+from openpyxl.styles import PatternFill
+from PIL import Image
+from reportlab import rl_config
+from reportlab.lib.colors import HexColor
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.pdfgen import canvas
+
+from CRUD import LOGO, MODIFIED_HEADER, MODIFIED_WIDTHS, modified_day_fill, modified_day_row
+from models import AdminModifiedPresence
+
+
+# Binary streams: smaller, and ASCII85 is encoded in pure Python without reportlab's accelerator
+rl_config.useA85 = 0
+
+NATIVE, LIBREOFFICE = "native", "libreoffice"
+PDF_RENDERERS = (NATIVE, LIBREOFFICE)
+
+# Sheet geometry in points. A column width counts characters of the default font, 7 px each
+# plus 5 px of padding at 96 dpi
+COLUMN_WIDTHS = [(width * 7 + 5) * 0.75 for width in MODIFIED_WIDTHS.values()]
+COLUMN_LEFTS = [sum(COLUMN_WIDTHS[:column]) for column in range(len(COLUMN_WIDTHS))]
+ROW_HEIGHT = 15
+LEFT_MARGIN, TOP_MARGIN = 0.3 * 72, 0.5 * 72
+# fitToWidth: the columns are shrunk to the printable width, never enlarged
+SCALE = min(1.0, (A4[0] - 2 * LEFT_MARGIN) / sum(COLUMN_WIDTHS))
+
+FONT, FONT_SIZE = "Helvetica", 10
+BOLD_FONT, BOLD_FONT_SIZE = "Helvetica-Bold", 10.5
+PADDING = 2
+BORDER_WIDTH = 0.5
+
+with Image.open(BytesIO(LOGO)) as logo_image:
+    LOGO_WIDTH, LOGO_HEIGHT = (pixels * 0.75 for pixels in logo_image.size)
+
+_colors = {}
+
+
+def fill_color(fill: PatternFill):
+    rgb = fill.fgColor.rgb[-6:]
+    if rgb not in _colors:
+        _colors[rgb] = HexColor(f"#{rgb}")
+    return _colors[rgb]
+
+
+def format_value(value, font: str, size: float, width: float) -> str:
+    """The text of a cell as the General format shows it, shortened to the width of its column."""
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        # Fewer decimals until it fits, like a spreadsheet does with numbers
+        for precision in range(10, 0, -1):
+            text = f"{value:.{precision}g}"
+            if stringWidth(text, font, size) <= width:
+                return text
+        return text
+    text = str(value)
+    while text and stringWidth(text, font, size) > width:
+        text = text[:-1]
+    return text
+
+
+class SheetCanvas:
+    """Draws cells by row and column, row 1 at the top of the printable area."""
+
+    def __init__(self, pdf: canvas.Canvas):
+        self.pdf = pdf
+        pdf.translate(LEFT_MARGIN, A4[1] - TOP_MARGIN)
+        pdf.scale(SCALE, SCALE)
+        pdf.setLineWidth(BORDER_WIDTH)
+
+    def cell(self, row: int, column: int, value, bold: bool = False, align: str = "left",
+             fill: Optional[PatternFill] = None, border: bool = False):
+        x, width = COLUMN_LEFTS[column], COLUMN_WIDTHS[column]
+        bottom = -row * ROW_HEIGHT
+        if fill is not None:
+            self.pdf.setFillColor(fill_color(fill))
+            self.pdf.rect(x, bottom, width, ROW_HEIGHT, stroke=0, fill=1)
+            self.pdf.setFillColorRGB(0, 0, 0)
+        if border:
+            self.pdf.rect(x, bottom, width, ROW_HEIGHT, stroke=1, fill=0)
+
+        font, size = (BOLD_FONT, BOLD_FONT_SIZE) if bold else (FONT, FONT_SIZE)
+        text = format_value(value, font, size, width - 2 * PADDING)
+        if not text:
+            return
+        self.pdf.setFont(font, size)
+        baseline = bottom + (ROW_HEIGHT - size) / 2 + 0.2 * size
+        if align == "center":
+            self.pdf.drawCentredString(x + width / 2, baseline, text)
+        elif align == "right":
+            self.pdf.drawRightString(x + width - PADDING, baseline, text)
+        else:
+            self.pdf.drawString(x + PADDING, baseline, text)
+
+    def label_row(self, row: int, first_label: str, first_value, second_label: str, second_value):
+        self.cell(row, 0, first_label, bold=True, align="center")
+        self.cell(row, 1, first_value, align="center")
+        self.cell(row, 2, second_label, bold=True, align="center")
+        # Unstyled, numbers are right aligned and text left aligned
+        self.cell(row, 3, second_value, align="right" if isinstance(second_value, (int, float)) else "left")
+
+
+def render_modified_pdf(presence_data: List[AdminModifiedPresence], employee) -> bytes:
+    """The PDF of create_excel_modified(presence_data, employee), on a single page."""
+    output = BytesIO()
+    pdf = canvas.Canvas(output, pagesize=A4, pageCompression=1)
+    pdf.setTitle(f"Presenze {employee.surname} {employee.name}")
+    sheet = SheetCanvas(pdf)
+
+    pdf.drawImage(ImageReader(BytesIO(LOGO)), 0, -LOGO_HEIGHT, LOGO_WIDTH, LOGO_HEIGHT, mask="auto")
+    sheet.label_row(7, "Cognome:", employee.surname, "Nome", employee.name)
+    sheet.label_row(10, "Anno", presence_data[0].date.year, "Mese", presence_data[0].date.month)
+
+    for column, title in enumerate(MODIFIED_HEADER):
+        sheet.cell(13, column, title, bold=True, align="center", border=True)
+    for row, day in enumerate(presence_data, start=14):
+        fill = modified_day_fill(day)
+        for column, value in enumerate(modified_day_row(day)):
+            sheet.cell(row, column, value, align="center", fill=fill, border=True)
+
+    pdf.showPage()
+    pdf.save()
+    return output.getvalue()
@@ -0,0 +1,51 @@
+"""Rebuild employee_month_summary from the presence tables.
+
+    python rebuild_month_summary.py                     # every month with presence data
+    python rebuild_month_summary.py --year 2025         # one year
+    python rebuild_month_summary.py --year 2025 --month 3 --user-id 12
+"""
+import argparse
+
+from sqlalchemy import extract, union
+
+from CRUD import refresh_month_summary
+from database import SessionLocal
+from models import AdminModifiedPresence, DailyPresence
+
+
+def months_with_presence(db, year=None, month=None, user_id=None):
+    selects = []
+    for model in (DailyPresence, AdminModifiedPresence):
+        query = db.query(model.employee_id,
+                         extract('year', model.date).label('year'),
+                         extract('month', model.date).label('month'))
+        if year:
+            query = query.filter(extract('year', model.date) == year)
+        if month:
+            query = query.filter(extract('month', model.date) == month)
+        if user_id:
+            query = query.filter(model.employee_id == user_id)
+        selects.append(query.statement)
+    return db.execute(union(*selects)).all()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the per-employee monthly presence summaries")
+    parser.add_argument("--year", type=int)
+    parser.add_argument("--month", type=int)
+    parser.add_argument("--user-id", type=int)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        months = months_with_presence(db, args.year, args.month, args.user_id)
+        for employee_id, year, month in months:
+            refresh_month_summary(db, employee_id, int(year), int(month))
+            db.commit()
+        print(f"Rebuilt {len(months)} month summaries")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
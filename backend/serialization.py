@@ -1,4 +1,4 @@
-from datetime import time, date
+from datetime import time, date, datetime
 from pydantic import BaseModel, EmailStr, validator
 from typing import Optional
 
@@ -28,10 +28,20 @@ class Token(BaseModel):
     token_type: str
     role: str
     user_id: int
+    refresh_token: Optional[str]
+
+
+class RefreshTokenRequest(BaseModel):
+    refresh_token: str
 
 
 class TokenData(BaseModel):
     work_email: str
+    # Claims of tokens issued by token_claims, missing from older tokens
+    user_id: Optional[int]
+    role: Optional[str]
+    active: Optional[bool]
+    token_version: Optional[int]
 
 
 class UserUpdate(UserBase):
@@ -162,3 +172,30 @@ class EmailRequestPerUser(BaseModel):
     class Config:
         orm_mode = True
 
+
+class ExportJobRequest(BaseModel):
+    year: int
+    month: int
+    pdf: bool = False
+
+    @validator("month")
+    def valid_month(cls, month):
+        if not 1 <= month <= 12:
+            raise ValueError("month must be between 1 and 12")
+        return month
+
+
+class ExportJobStatus(BaseModel):
+    id: str
+    year: int
+    month: int
+    pdf: bool
+    status: str  # pending, running, done or failed
+    completed: int
+    total: Optional[int]
+    error: Optional[str]
+    created_at: datetime
+    finished_at: Optional[datetime]
+
+    class Config:
+        orm_mode = True
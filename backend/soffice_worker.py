@@ -0,0 +1,91 @@
+"""Long-lived spreadsheet to PDF converter, driven by pdf_converter.py over stdin/stdout.
+
+Runs under the python that ships UNO with LibreOffice (python3-uno), not the app's:
+
+    /usr/bin/python3 soffice_worker.py <profile dir> <pipe name> <soffice binary>
+
+Starts one headless soffice with its own profile, prints {"ready": true} and then answers one
+JSON line per request line: {"input": ..., "output": ...} converts a file, {"ping": true} checks
+that soffice still answers.
+"""
+import json
+import subprocess
+import sys
+import time
+
+import uno
+from com.sun.star.beans import PropertyValue
+
+
+START_TIMEOUT_SECONDS = 60
+
+
+def prop(name, value):
+    property_value = PropertyValue()
+    property_value.Name = name
+    property_value.Value = value
+    return property_value
+
+
+def respond(**response):
+    sys.stdout.write(json.dumps(response) + "\n")
+    sys.stdout.flush()
+
+
+def connect(pipe_name):
+    local_context = uno.getComponentContext()
+    resolver = local_context.ServiceManager.createInstanceWithContext("com.sun.star.bridge.UnoUrlResolver",
+                                                                      local_context)
+    deadline = time.monotonic() + START_TIMEOUT_SECONDS
+    while True:
+        try:
+            context = resolver.resolve(f"uno:pipe,name={pipe_name};urp;StarOffice.ComponentContext")
+            return context.ServiceManager.createInstanceWithContext("com.sun.star.frame.Desktop", context)
+        except Exception:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def convert(desktop, input_path, output_path):
+    document = desktop.loadComponentFromURL(uno.systemPathToFileUrl(input_path), "_blank", 0,
+                                            (prop("Hidden", True), prop("ReadOnly", True)))
+    try:
+        document.storeToURL(uno.systemPathToFileUrl(output_path), (prop("FilterName", "calc_pdf_Export"),))
+    finally:
+        document.close(True)
+
+
+def main():
+    profile_dir, pipe_name, soffice = sys.argv[1:4]
+    office = subprocess.Popen(
+        [soffice, "--headless", "--invisible", "--nologo", "--nodefault", "--norestore", "--nolockcheck",
+         f"-env:UserInstallation={uno.systemPathToFileUrl(profile_dir)}",
+         f"--accept=pipe,name={pipe_name};urp;StarOffice.ComponentContext"],
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        desktop = connect(pipe_name)
+        respond(ready=True)
+        for line in sys.stdin:
+            request = json.loads(line)
+            try:
+                if request.get("ping"):
+                    desktop.getComponents()
+                else:
+                    convert(desktop, request["input"], request["output"])
+                respond(ok=True)
+            except Exception as e:
+                respond(ok=False, error=str(e))
+        try:
+            desktop.terminate()
+        except Exception:
+            pass
+    finally:
+        try:
+            office.wait(10)
+        except subprocess.TimeoutExpired:
+            office.kill()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 import {
   Employee,
   EmployeeOverview,
+  ExportJob,
   Holiday,
   HolidayResponse,
   PresenceData,
@@ -117,21 +118,64 @@ export const ExportAdminPresenceData = async (
   );
 };
 
-export const ExportAllEmployeesPresenceData = async (
+export const CreateExportJob = async (
   year: string,
   month: string,
   pdfBool: boolean
-): Promise<Blob> => {
+): Promise<ExportJob> => {
+  return handleApiCall<ExportJob>(
+    () =>
+      axiosInstance.post("/export-jobs", {
+        year: Number(year),
+        month: Number(month),
+        pdf: pdfBool,
+      }),
+    "CreateExportJob"
+  );
+};
+
+export const GetExportJob = async (jobId: string): Promise<ExportJob> => {
+  return handleApiCall<ExportJob>(
+    () => axiosInstance.get(`/export-jobs/${jobId}`),
+    "GetExportJob"
+  );
+};
+
+export const DownloadExportJob = async (jobId: string): Promise<Blob> => {
   return handleApiCall<Blob>(
     () =>
-      axiosInstance.get(
-        `/export_all_modified_presence_overview/${year}/${month}/${pdfBool}`,
-        { responseType: "blob" }
-      ),
-    "ExportAllEmployeesPresenceData"
+      axiosInstance.get(`/export-jobs/${jobId}/download`, {
+        responseType: "blob",
+      }),
+    "DownloadExportJob"
   );
 };
 
+const EXPORT_POLL_INTERVAL_MS = 2000;
+
+// The archive is built by the export worker, poll the job until it is ready
+export const ExportAllEmployeesPresenceData = async (
+  year: string,
+  month: string,
+  pdfBool: boolean,
+  onProgress?: (completed: number, total: number) => void
+): Promise<Blob> => {
+  let job = await CreateExportJob(year, month, pdfBool);
+  while (job.status !== "done") {
+    if (job.status === "failed") {
+      throw new Error(job.error ?? "Export failed");
+    }
+    if (onProgress && job.total !== null) {
+      onProgress(job.completed, job.total);
+    }
+    await new Promise((resolve) =>
+      setTimeout(resolve, EXPORT_POLL_INTERVAL_MS)
+    );
+    job = await GetExportJob(job.id);
+  }
+  return DownloadExportJob(job.id);
+};
+
 export const SendEmailToMissing = async (
   yearMonth: string,
   textBody: string,
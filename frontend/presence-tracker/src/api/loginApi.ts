@@ -24,6 +24,27 @@ export const LoginUser = async (
   );
 };
 
+// Plain axios: these run from the axiosInstance interceptor and must not be retried by it
+export const RefreshAccessToken = async (
+  refreshToken: string
+): Promise<LoginResponse> => {
+  return handleApiCall<LoginResponse>(
+    () =>
+      axios.post(`${baseUrl}/token/refresh`, { refresh_token: refreshToken }),
+    "RefreshAccessToken"
+  );
+};
+
+export const RevokeRefreshToken = async (
+  refreshToken: string
+): Promise<void> => {
+  return handleApiCall<void>(
+    () =>
+      axios.post(`${baseUrl}/token/revoke`, { refresh_token: refreshToken }),
+    "RevokeRefreshToken"
+  );
+};
+
 export const SendOtp = async (email: string): Promise<void> => {
   return handleApiCall<void>(
     () => axios.post(`${baseUrl}/send_otp`, { email }),
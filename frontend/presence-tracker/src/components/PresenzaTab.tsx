@@ -205,13 +205,17 @@ const PresenzaTab: React.FC = () => {
   };
 
   const handleAllEmployeesExport = async (fileType: "excel" | "pdf") => {
-    toast.loading("Exporting...");
+    const toastId = toast.loading("Exporting...");
 
     try {
       const response = await ExportAllEmployeesPresenceData(
         selectedYear,
         selectedMonth,
-        fileType === "pdf"
+        fileType === "pdf",
+        (completed, total) =>
+          toast.update(toastId, {
+            render: `Exporting... ${completed}/${total}`,
+          })
       );
 
       downloadFile(
@@ -4,7 +4,13 @@ interface AuthContextType {
   isAuthenticated: boolean;
   userId: number | null;
   userRole: string | null;
-  login: (token: string, role: string, id: number, expiresIn: Date) => void;
+  login: (
+    token: string,
+    role: string,
+    id: number,
+    expiresIn: Date,
+    refreshToken: string | null
+  ) => void;
   logout: () => void;
 }
 
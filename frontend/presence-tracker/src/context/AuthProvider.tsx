@@ -1,5 +1,11 @@
 import React, { useEffect, useState } from "react";
 import AuthContext from "./AuthContext";
+import { RevokeRefreshToken } from "../api/loginApi";
+import {
+  SESSION_EXPIRED_EVENT,
+  refreshAccessToken,
+  TOKEN_RENEWAL_MARGIN_MS,
+} from "../utils/authTokens";
 
 interface AuthProviderProps {
   children: React.ReactNode;
@@ -20,13 +26,22 @@ const AuthProvider: React.FC<AuthProviderProps> = ({ children }) => {
     return id ? parseInt(id) : null;
   });
 
-  const login = (token: string, role: string, id: number, expiresIn: Date) => {
+  const login = (
+    token: string,
+    role: string,
+    id: number,
+    expiresIn: Date,
+    refreshToken: string | null
+  ) => {
     // const expiryTime = new Date().getTime() + expiresIn * 1000;
 
     localStorage.setItem("token", token);
     localStorage.setItem("user_role", role);
     localStorage.setItem("user_id", id.toString());
     localStorage.setItem("token_expiry", expiresIn.toString());
+    if (refreshToken) {
+      localStorage.setItem("refresh_token", refreshToken);
+    }
 
     setIsAuthenticated(true);
     setUserRole(role);
@@ -34,6 +49,13 @@ const AuthProvider: React.FC<AuthProviderProps> = ({ children }) => {
   };
 
   const logout = () => {
+    // Closes the session server side too, the refresh token could renew it otherwise
+    const refreshToken = localStorage.getItem("refresh_token");
+    if (refreshToken) {
+      RevokeRefreshToken(refreshToken).catch(() => {});
+    }
+
+    localStorage.removeItem("refresh_token");
     localStorage.removeItem("token");
     localStorage.removeItem("user_role");
     localStorage.removeItem("user_id");
@@ -48,8 +70,18 @@ const AuthProvider: React.FC<AuthProviderProps> = ({ children }) => {
     const checkTokenExpiry = () => {
       const expiry = localStorage.getItem("token_expiry");
       if (expiry) {
-        const isTokenValid = new Date() < new Date(expiry);
-        if (!isTokenValid) {
+        const remaining = new Date(expiry).getTime() - Date.now();
+        // Renewed ahead of its expiry, without asking for the password again
+        if (
+          remaining < TOKEN_RENEWAL_MARGIN_MS &&
+          localStorage.getItem("refresh_token")
+        ) {
+          refreshAccessToken().catch(() => {
+            if (new Date() >= new Date(expiry)) {
+              logout();
+            }
+          });
+        } else if (remaining <= 0) {
           logout();
         }
       }
@@ -58,8 +90,12 @@ const AuthProvider: React.FC<AuthProviderProps> = ({ children }) => {
     checkTokenExpiry();
 
     const interval = setInterval(checkTokenExpiry, 60000);
+    window.addEventListener(SESSION_EXPIRED_EVENT, logout);
 
-    return () => clearInterval(interval);
+    return () => {
+      clearInterval(interval);
+      window.removeEventListener(SESSION_EXPIRED_EVENT, logout);
+    };
   }, []);
 
   return (
@@ -110,7 +110,7 @@ const LoginPage: React.FC = () => {
 
     try {
       const response = await LoginUser(data.username, data.password);
-      const { access_token, role, user_id } = response;
+      const { access_token, role, user_id, refresh_token } = response;
 
       try {
         const decodedToken = jwtDecode(access_token);
@@ -119,7 +119,13 @@ const LoginPage: React.FC = () => {
           throw new Error("Token expiration not found");
         }
 
-        login(access_token, role, user_id, new Date(decodedToken.exp * 1000));
+        login(
+          access_token,
+          role,
+          user_id,
+          new Date(decodedToken.exp * 1000),
+          refresh_token
+        );
 
         toast.update(toastId, {
           render: "Login successful!",
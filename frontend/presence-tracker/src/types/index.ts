@@ -2,6 +2,7 @@ export interface LoginResponse {
   access_token: string;
   role: string;
   user_id: number;
+  refresh_token: string | null;
 }
 
 export interface RegisterInputs {
@@ -94,6 +95,19 @@ export interface ExcelApiResponse {
   detail: string;
 }
 
+export interface ExportJob {
+  id: string;
+  year: number;
+  month: number;
+  pdf: boolean;
+  status: "pending" | "running" | "done" | "failed";
+  completed: number;
+  total: number | null;
+  error: string | null;
+  created_at: string;
+  finished_at: string | null;
+}
+
 export interface EmailInputs {
   emailSubject: string;
   emailBody: string;
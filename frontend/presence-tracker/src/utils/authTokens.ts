@@ -0,0 +1,35 @@
+import { jwtDecode } from "jwt-decode";
+import { RefreshAccessToken } from "../api/loginApi";
+
+// Dispatched when the session can no longer be renewed, AuthProvider logs out
+export const SESSION_EXPIRED_EVENT = "session-expired";
+
+export const TOKEN_RENEWAL_MARGIN_MS = 5 * 60 * 1000;
+
+let renewal: Promise<string> | null = null;
+
+// The refresh token is rotated on every use, so concurrent callers share one renewal
+export const refreshAccessToken = (): Promise<string> => {
+  if (!renewal) {
+    const refreshToken = localStorage.getItem("refresh_token");
+    if (!refreshToken) {
+      return Promise.reject(new Error("No refresh token"));
+    }
+    renewal = RefreshAccessToken(refreshToken)
+      .then(({ access_token, refresh_token }) => {
+        const { exp } = jwtDecode(access_token);
+        localStorage.setItem("token", access_token);
+        if (exp) {
+          localStorage.setItem("token_expiry", new Date(exp * 1000).toString());
+        }
+        if (refresh_token) {
+          localStorage.setItem("refresh_token", refresh_token);
+        }
+        return access_token;
+      })
+      .finally(() => {
+        renewal = null;
+      });
+  }
+  return renewal;
+};
@@ -1,4 +1,5 @@
-import axios from "axios";
+import axios, { type InternalAxiosRequestConfig } from "axios";
+import { SESSION_EXPIRED_EVENT, refreshAccessToken } from "./authTokens";
 
 const axiosInstance = axios.create({
   baseURL: "/api",
@@ -26,6 +27,26 @@ axiosInstance.interceptors.response.use(
       const data = await error.response.data.text();
       error.response.data = data ? JSON.parse(data) : {};
     }
+
+    // Expired access token: renew it once with the refresh token and replay the request
+    const request = error.config as
+      | (InternalAxiosRequestConfig & { _retried?: boolean })
+      | undefined;
+    if (
+      error.response?.status === 401 &&
+      request &&
+      !request._retried &&
+      localStorage.getItem("refresh_token")
+    ) {
+      request._retried = true;
+      try {
+        const token = await refreshAccessToken();
+        request.headers["Authorization"] = "Bearer " + token;
+        return axiosInstance(request);
+      } catch {
+        window.dispatchEvent(new Event(SESSION_EXPIRED_EVENT));
+      }
+    }
     return Promise.reject(error);
   }
 );